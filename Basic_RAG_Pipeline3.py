@@ -1,14 +1,27 @@
 #All the imports
 import os
 import ollama
+import numpy as np
 import uuid
 import json
+import hashlib
+import re
 import psycopg2
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from dotenv import load_dotenv
 from pgvector.psycopg2 import register_vector
 import fitz
+import requests
 import streamlit as st
 import sys
+import time
+import threading
+import sqlite3
+import weakref
+from array import array
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 print("PYTHON PATH:", sys.executable)
 
 #loads environment variables from the .env file
@@ -23,18 +36,228 @@ EMBED_MODEL = os.getenv("EMBED_MODEL")
 LLM_MODEL   = os.getenv("LLM_MODEL")
 TABLE_DIM   = int(os.getenv("TABLE_DIM"))
 
-#opens a connection to the PostgreSQL database
-def get_db_connection():
-    conn = psycopg2.connect(
+#how many paragraphs go into one embedding request, and how many requests run at once
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "16"))
+EMBED_WORKERS    = int(os.getenv("EMBED_WORKERS", "4"))
+
+#how many embedded chunks are buffered before they are written to the database in one go
+INSERT_FLUSH_SIZE = int(os.getenv("INSERT_FLUSH_SIZE", "500"))
+
+#size of the shared database connection pool
+#ThreadedConnectionPool opens DB_POOL_MIN connections up front (per process) and keeps that many open;
+#callers beyond DB_POOL_MAX wait up to DB_POOL_WAIT_SECONDS for a connection instead of failing at once
+DB_POOL_MIN          = int(os.getenv("DB_POOL_MIN", "2"))
+DB_POOL_MAX          = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_WAIT_SECONDS = float(os.getenv("DB_POOL_WAIT_SECONDS", "30"))
+
+#re-ranking: when RERANK_MODEL is set, RERANK_CANDIDATES chunks are fetched from the index and
+#scored by that local model in one batch, and only the best top_n go into the prompt
+RERANK_MODEL      = os.getenv("RERANK_MODEL", "")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_MAX_CHARS  = int(os.getenv("RERANK_MAX_CHARS", "800")) #each passage is cut to this for scoring
+
+#context packing: the retrieved chunks that go into the prompt are limited to CONTEXT_TOKEN_BUDGET
+#tokens, and a chunk whose words overlap an already picked one by DEDUP_THRESHOLD or more is skipped
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2048"))
+DEDUP_THRESHOLD      = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+
+#semantic answer cache: a question whose embedding is at least ANSWER_CACHE_THRESHOLD cosine-similar
+#to an earlier one, and that retrieves the same chunks, gets the earlier answer back
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL       = float(os.getenv("ANSWER_CACHE_TTL", "3600")) #seconds
+ANSWER_CACHE_SIZE      = int(os.getenv("ANSWER_CACHE_SIZE", "500"))
+
+#PDFs with more pages than PDF_PARALLEL_PAGES are extracted by a pool of PDF_WORKERS processes,
+#PDF_PAGES_PER_TASK pages at a time
+PDF_PARALLEL_PAGES = int(os.getenv("PDF_PARALLEL_PAGES", "50"))
+PDF_WORKERS        = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 2)))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+
+#how chunks are cut: "token" packs sentences up to CHUNK_TOKENS with some overlap,
+#"paragraph" keeps the plain double-newline split
+CHUNKER              = os.getenv("CHUNKER", "token")
+CHUNK_TOKENS         = int(os.getenv("CHUNK_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+CHUNK_MIN_TOKENS     = int(os.getenv("CHUNK_MIN_TOKENS", "32"))
+if CHUNKER not in ("token", "paragraph"):
+    raise ValueError(f"CHUNKER must be token or paragraph, got {CHUNKER!r}")
+#an overlap as big as the chunk would start every chunk with (almost) the whole previous one
+if not 0 <= CHUNK_OVERLAP_TOKENS < CHUNK_TOKENS:
+    raise ValueError(f"CHUNK_OVERLAP_TOKENS must be at least 0 and less than CHUNK_TOKENS ({CHUNK_TOKENS}), got {CHUNK_OVERLAP_TOKENS}")
+
+#embedding cache: a small in-memory LRU in front of a bigger SQLite file on disk
+EMBED_CACHE_PATH        = os.getenv("EMBED_CACHE_PATH", "embedding_cache.sqlite3")
+EMBED_CACHE_MEMORY_SIZE = int(os.getenv("EMBED_CACHE_MEMORY_SIZE", "10000"))
+EMBED_CACHE_DISK_SIZE   = int(os.getenv("EMBED_CACHE_DISK_SIZE", "500000"))
+
+#approximate nearest neighbour index on document_chunks.embedding
+#INDEX_TYPE is hnsw, ivfflat or none; DISTANCE_OP is <-> (L2), <=> (cosine) or <#> (inner product)
+INDEX_TYPE           = os.getenv("INDEX_TYPE", "hnsw").lower()
+DISTANCE_OP          = os.getenv("DISTANCE_OP", "<->")
+HNSW_M               = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+HNSW_EF_SEARCH       = int(os.getenv("HNSW_EF_SEARCH", "40"))
+IVFFLAT_LISTS        = int(os.getenv("IVFFLAT_LISTS", "0")) #0 means pick from the row count
+IVFFLAT_PROBES       = int(os.getenv("IVFFLAT_PROBES", "10"))
+#pgvector 0.8+ keeps scanning the index until enough rows pass a WHERE filter
+#(relaxed_order or strict_order, only used for filtered searches; skipped on older pgvector versions,
+#an empty string turns it off)
+ITERATIVE_SCAN       = os.getenv("ITERATIVE_SCAN", "relaxed_order")
+INDEX_NAME           = "document_chunks_embedding_idx"
+
+#compact first-pass search: "halfvec" indexes the embeddings as 16-bit floats, "binary" as one bit
+#per dimension (hamming distance); the QUANT_OVERFETCH x top_n candidates found that way are then
+#re-ranked with the full-precision embedding column. "none" searches the full vectors directly
+QUANTIZATION    = os.getenv("QUANTIZATION", "none").lower()
+QUANT_OVERFETCH = int(os.getenv("QUANT_OVERFETCH", "4"))
+
+#retrieval: "vector" orders by embedding distance only, "hybrid" also runs Postgres full-text search
+#and combines both rankings with reciprocal rank fusion (score = sum of 1 / (RRF_K + rank))
+RETRIEVAL_MODE     = os.getenv("RETRIEVAL_MODE", "hybrid").lower()
+TEXT_SEARCH_CONFIG = os.getenv("TEXT_SEARCH_CONFIG", "english")
+RRF_K              = int(os.getenv("RRF_K", "60"))
+HYBRID_CANDIDATES  = int(os.getenv("HYBRID_CANDIDATES", "20")) #rows each retriever contributes to the fusion
+
+#thin-client mode: when set (e.g. http://localhost:8000) the UI sends uploads and questions
+#to rag_service.py instead of talking to Postgres and Ollama itself
+RAG_SERVICE_URL = os.getenv("RAG_SERVICE_URL", "").rstrip("/")
+RAG_SERVICE_TIMEOUT        = float(os.getenv("RAG_SERVICE_TIMEOUT", "10"))         #seconds, uploads / status / lists
+RAG_SERVICE_ANSWER_TIMEOUT = float(os.getenv("RAG_SERVICE_ANSWER_TIMEOUT", "300")) #seconds between answer tokens
+
+#the pgvector operator class that matches each distance operator
+OPERATOR_CLASSES = {
+    "<->": "vector_l2_ops",
+    "<=>": "vector_cosine_ops",
+    "<#>": "vector_ip_ops",
+}
+if DISTANCE_OP not in OPERATOR_CLASSES:
+    raise ValueError(f"DISTANCE_OP must be one of {list(OPERATOR_CLASSES)}, got {DISTANCE_OP!r}")
+if RETRIEVAL_MODE not in ("vector", "hybrid"):
+    raise ValueError(f"RETRIEVAL_MODE must be vector or hybrid, got {RETRIEVAL_MODE!r}")
+if not re.fullmatch(r"\w+", TEXT_SEARCH_CONFIG):
+    raise ValueError(f"TEXT_SEARCH_CONFIG must be a text search configuration name, got {TEXT_SEARCH_CONFIG!r}")
+if QUANTIZATION not in ("none", "halfvec", "binary"):
+    raise ValueError(f"QUANTIZATION must be none, halfvec or binary, got {QUANTIZATION!r}")
+if INDEX_TYPE not in ("hnsw", "ivfflat", "none"):
+    raise ValueError(f"INDEX_TYPE must be hnsw, ivfflat or none, got {INDEX_TYPE!r}")
+
+#creates one connection pool for the whole process
+#st.cache_resource keeps it alive across Streamlit reruns, so a rerun doesn't reconnect
+#the dict also holds the usage counters, which connections already have the vector type registered,
+#and a semaphore with one slot per connection (getconn raises PoolError when the pool is exhausted)
+@st.cache_resource
+def get_db_pool():
+    pool = ThreadedConnectionPool(
+        min(DB_POOL_MIN, DB_POOL_MAX),
+        DB_POOL_MAX,
         dbname   = DB_NAME,
         user     = DB_USER,
         password = DB_PASS,
         host     = DB_HOST,
         port     = DB_PORT
     )
-    conn.autocommit = True
+    return {
+        "pool": pool,
+        "lock": threading.Lock(),
+        "slots": threading.BoundedSemaphore(DB_POOL_MAX),
+        "vector_ready": weakref.WeakSet(), #connections that went through register_vector (closed ones drop out)
+        "checkouts": 0,
+        "in_use": 0,
+        "peak_in_use": 0,
+        "health_check_failures": 0,
+    }
+
+#runs a cheap query to make sure a pooled connection is still alive
+def is_connection_healthy(conn):
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1;")
+        return True
+    except psycopg2.Error:
+        return False
+
+#registers the pgvector type on a connection once, so embeddings come back as vectors
+#if the extension doesn't exist yet (first run) this is skipped and ensure_schema registers it later
+def register_vector_once(conn):
+    db = get_db_pool()
+    if conn in db["vector_ready"]:
+        return
+    try:
+        register_vector(conn)
+        db["vector_ready"].add(conn)
+    except psycopg2.ProgrammingError:
+        pass
+
+#borrows a connection from the pool
+#waits for a free connection when all of them are in use (up to DB_POOL_WAIT_SECONDS)
+#broken connections are thrown away and replaced, and the vector type is already registered
+#give it back with release_db_connection when done
+def get_db_connection():
+    db = get_db_pool()
+    if not db["slots"].acquire(timeout=DB_POOL_WAIT_SECONDS):
+        raise PoolError(f"No database connection became free within {DB_POOL_WAIT_SECONDS:g}s")
+    try:
+        for _ in range(DB_POOL_MAX + 1):
+            conn = db["pool"].getconn()
+            if not conn.closed:
+                conn.autocommit = True
+            if is_connection_healthy(conn):
+                break
+            with db["lock"]:
+                db["health_check_failures"] += 1
+                db["vector_ready"].discard(conn)
+            db["pool"].putconn(conn, close=True)
+        else:
+            raise psycopg2.OperationalError("Could not get a healthy connection from the pool")
+    except Exception:
+        db["slots"].release()
+        raise
+    register_vector_once(conn)
+    with db["lock"]:
+        db["checkouts"]  += 1
+        db["in_use"]     += 1
+        db["peak_in_use"] = max(db["peak_in_use"], db["in_use"])
     return conn
 
+#returns a connection to the pool (any unfinished transaction is rolled back first)
+def release_db_connection(conn):
+    db = get_db_pool()
+    if not conn.closed and not conn.autocommit:
+        conn.rollback()
+    with db["lock"]:
+        db["in_use"] -= 1
+        if conn.closed:
+            db["vector_ready"].discard(conn)
+    db["pool"].putconn(conn, close=bool(conn.closed))
+    db["slots"].release()
+
+#returns the pool usage numbers (shown in the sidebar)
+def pool_stats():
+    db = get_db_pool()
+    with db["lock"]:
+        return {
+            "max_size": DB_POOL_MAX,
+            "in_use": db["in_use"],
+            "peak_in_use": db["peak_in_use"],
+            "checkouts": db["checkouts"],
+            "health_check_failures": db["health_check_failures"],
+        }
+
+#catalog lookups that let ensure_schema skip DDL (and the table locks it takes) when nothing is missing
+def column_exists(cur, table, column):
+    cur.execute("""
+    SELECT EXISTS (
+      SELECT 1 FROM pg_attribute
+      WHERE attrelid = to_regclass(%s) AND attname = %s AND NOT attisdropped
+    );""", (table, column))
+    return cur.fetchone()[0]
+
+def index_exists(cur, name):
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (name,))
+    return cur.fetchone()[0]
+
 #ensure the vector extension is installed
 #creates a table called document_chunks with the columns
 #1. chunk_id- chunk ID
@@ -46,7 +269,7 @@ def ensure_schema():
     conn = get_db_connection()
     cur  = conn.cursor()
     cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
-    register_vector(conn)
+    register_vector_once(conn)
     cur.execute(f"""
     CREATE TABLE IF NOT EXISTS document_chunks (
       chunk_id    UUID PRIMARY KEY,
@@ -56,93 +279,1266 @@ def ensure_schema():
       embedding   VECTOR({TABLE_DIM}) NOT NULL
     );
     """)
+    #one row per document: the hash of its content when it was last stored
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS document_manifest (
+      document_id  TEXT        PRIMARY KEY,
+      content_hash TEXT        NOT NULL,
+      chunk_count  INTEGER     NOT NULL,
+      updated_at   TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """)
+    #full-text search column for hybrid retrieval, kept up to date by Postgres itself
+    #(adding it to a table that already has rows rewrites the table once)
+    #ensure_schema runs on every page load: ALTER TABLE takes its ACCESS EXCLUSIVE lock before it looks
+    #at IF NOT EXISTS, so it would queue behind a running ingestion and stall every read queued behind it;
+    #the catalog is checked first and the DDL only runs when the column is really missing
+    if not column_exists(cur, "document_chunks", "text_tsv"):
+        cur.execute(f"""
+        ALTER TABLE document_chunks
+          ADD COLUMN IF NOT EXISTS text_tsv TSVECTOR
+          GENERATED ALWAYS AS (to_tsvector('{TEXT_SEARCH_CONFIG}', text)) STORED;
+        """)
+    if not index_exists(cur, "document_chunks_text_tsv_idx"):
+        cur.execute("CREATE INDEX IF NOT EXISTS document_chunks_text_tsv_idx ON document_chunks USING GIN (text_tsv);")
+    #indexes for scoped retrieval: by document, and by metadata predicates (containment)
+    #(CREATE INDEX takes a SHARE lock before checking IF NOT EXISTS, which waits for any running ingestion)
+    if not index_exists(cur, "document_chunks_document_id_idx"):
+        cur.execute("CREATE INDEX IF NOT EXISTS document_chunks_document_id_idx ON document_chunks (document_id);")
+    if not index_exists(cur, "document_chunks_metadata_idx"):
+        cur.execute("CREATE INDEX IF NOT EXISTS document_chunks_metadata_idx ON document_chunks USING GIN (metadata jsonb_path_ops);")
+    #the ANN index is only built here while the table is empty (instant); over existing rows a plain
+    #CREATE INDEX would block writes and IVFFlat would get its lists from a row count of 0,
+    #so then it is left to rebuild-index, which counts the rows and builds concurrently
+    #(that holds for every QUANTIZATION layout; over existing rows a compact layout's index is left
+    #to migrate-quantization, which builds it concurrently and drops the other layouts' indexes)
+    if INDEX_TYPE != "none":
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL, EXISTS (SELECT 1 FROM document_chunks);", (index_name(),))
+        has_index, has_rows = cur.fetchone()
+        if not has_index and not has_rows:
+            cur.execute(create_index_sql(index_name(), row_count=0))
+        elif not has_index and QUANTIZATION != "none":
+            print(f"No {index_name()} index for QUANTIZATION={QUANTIZATION} yet; "
+                  "build it with: python Basic_RAG_Pipeline3.py migrate-quantization")
+        elif not has_index:
+            print(f"document_chunks has rows but no {index_name()} index; build it with: python Basic_RAG_Pipeline3.py rebuild-index")
     cur.close()
-    conn.close()
+    release_db_connection(conn)
+
+#IVFFlat needs its number of lists picked from the table size (pgvector's rule of thumb:
+#rows / 1000 up to a million rows, sqrt(rows) after that)
+def ivfflat_lists(row_count):
+    if IVFFLAT_LISTS > 0:
+        return IVFFLAT_LISTS
+    if row_count <= 1_000_000:
+        return max(1, row_count // 1000)
+    return int(row_count ** 0.5)
+
+#each storage layout gets its own index name, so they can exist side by side during a migration
+def index_name(quantization=QUANTIZATION):
+    return INDEX_NAME if quantization == "none" else f"{INDEX_NAME}_{quantization}"
+
+#the indexed expression and its operator class for a storage layout
+#(a query only uses the index if it orders by exactly the same expression, see quantized_distance_sql)
+def index_target(quantization=QUANTIZATION):
+    if quantization == "halfvec":
+        return f"(embedding::halfvec({TABLE_DIM}))", OPERATOR_CLASSES[DISTANCE_OP].replace("vector_", "halfvec_")
+    if quantization == "binary":
+        return f"(binary_quantize(embedding)::bit({TABLE_DIM}))", "bit_hamming_ops"
+    return "embedding", OPERATOR_CLASSES[DISTANCE_OP]
+
+#distance between a row and %(q_emb)s in the compact layout (used to order first-pass candidates)
+def quantized_distance_sql(quantization=QUANTIZATION):
+    if quantization == "halfvec":
+        return f"embedding::halfvec({TABLE_DIM}) {DISTANCE_OP} %(q_emb)s::vector::halfvec({TABLE_DIM})"
+    if quantization == "binary":
+        return f"binary_quantize(embedding)::bit({TABLE_DIM}) <~> binary_quantize(%(q_emb)s::vector)::bit({TABLE_DIM})"
+    return f"embedding {DISTANCE_OP} %(q_emb)s::vector"
+
+#how many rows the index has to produce for top_n results in a layout
+def first_pass_size(top_n, quantization=QUANTIZATION):
+    return top_n if quantization == "none" else top_n * QUANT_OVERFETCH
+
+#SQL for the `limit` nearest chunks as (columns..., distance), ordered by full-precision distance
+#in a quantized layout the compact index finds limit * QUANT_OVERFETCH candidates first,
+#and only those are re-ranked against the full-precision embeddings
+def nearest_sql(columns, where, limit, quantization=QUANTIZATION):
+    if quantization == "none":
+        return f"""
+          SELECT {columns}, embedding {DISTANCE_OP} %(q_emb)s::vector AS distance
+          FROM document_chunks
+          {where}
+          ORDER BY distance
+          LIMIT {limit}"""
+    return f"""
+          SELECT {columns}, embedding {DISTANCE_OP} %(q_emb)s::vector AS distance
+          FROM (
+            SELECT {columns}, embedding
+            FROM document_chunks
+            {where}
+            ORDER BY {quantized_distance_sql(quantization)}
+            LIMIT {limit} * {QUANT_OVERFETCH}
+          ) AS candidates
+          ORDER BY distance
+          LIMIT {limit}"""
+
+#builds the CREATE INDEX statement for the configured index type, distance operator and storage layout
+def create_index_sql(name, row_count, concurrently=False, quantization=QUANTIZATION):
+    target, opclass = index_target(quantization)
+    how = "CONCURRENTLY " if concurrently else ""
+    if INDEX_TYPE == "hnsw":
+        options = f"m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION}"
+    else:
+        options = f"lists = {ivfflat_lists(row_count)}"
+    return (f"CREATE INDEX {how}IF NOT EXISTS {name} ON document_chunks "
+            f"USING {INDEX_TYPE} ({target} {opclass}) WITH ({options});")
+
+#rebuilds the ANN index, e.g. after a bulk load
+#the new index is built next to the old one and swapped in, so queries keep using an index meanwhile
+#(IVFFlat especially needs this: its lists are computed from the rows present at build time)
+def rebuild_index():
+    if INDEX_TYPE == "none":
+        print("INDEX_TYPE is none, nothing to rebuild")
+        return
+    name = index_name()
+    conn = get_db_connection()
+    cur  = conn.cursor()
+    cur.execute("SELECT count(*) FROM document_chunks;")
+    row_count = cur.fetchone()[0]
+    start = time.perf_counter()
+    cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}_new;")
+    cur.execute(create_index_sql(f"{name}_new", row_count, concurrently=True))
+    cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name};")
+    cur.execute(f"ALTER INDEX {name}_new RENAME TO {name};")
+    cur.execute("ANALYZE document_chunks;")
+    print(f"Rebuilt {INDEX_TYPE} index ({QUANTIZATION}) over {row_count} rows in {time.perf_counter() - start:.1f}s")
+    cur.close()
+    release_db_connection(conn)
+
+#moves existing rows over to the configured QUANTIZATION layout
+#the compact index is built concurrently over the rows already in the table (reads and writes keep
+#working meanwhile); once it is ready the indexes of the other layouts are dropped unless keep_old is set
+#the full-precision column stays, it is what the candidates get re-ranked against
+def migrate_quantization(keep_old=False):
+    if INDEX_TYPE == "none":
+        print("INDEX_TYPE is none, there is no index to migrate")
+        return
+    conn = get_db_connection()
+    cur  = conn.cursor()
+    cur.execute("SELECT count(*) FROM document_chunks;")
+    row_count = cur.fetchone()[0]
+    start = time.perf_counter()
+    cur.execute(create_index_sql(index_name(), row_count, concurrently=True))
+    print(f"Built {index_name()} over {row_count} rows in {time.perf_counter() - start:.1f}s")
+    if not keep_old:
+        for other in ("none", "halfvec", "binary"):
+            if other != QUANTIZATION:
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name(other)};")
+    cur.execute("ANALYZE document_chunks;")
+    cur.close()
+    release_db_connection(conn)
+
+#whether the installed pgvector has the iterative_scan settings (0.8+)
+#on older versions PostgreSQL 15+ rejects SET on unknown names under the extension's prefix
+#read once per process from pg_extension (ensure_schema has created the extension by then)
+@st.cache_resource
+def iterative_scan_supported():
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector';")
+            row = cur.fetchone()
+    finally:
+        release_db_connection(conn)
+    if row is None:
+        return False
+    return tuple(int(part) for part in re.findall(r"\d+", row[0])[:2]) >= (0, 8)
+
+#the iterative scan setting for the index type in use, or None when it can't or shouldn't be set
+def iterative_scan_setting():
+    if INDEX_TYPE == "none" or not ITERATIVE_SCAN or not iterative_scan_supported():
+        return None
+    return f"{INDEX_TYPE}.iterative_scan"
+
+#re-embeds the rows already in document_chunks with the current embedding path
+#rows stored before embeddings went through /api/embed hold unnormalized /api/embeddings vectors,
+#which rank differently from the normalized query vectors under the L2 operator
+#works through the table batch_size rows at a time in chunk_id order, each batch committed on its own,
+#so ingestion and queries keep running; texts already in the embedding cache aren't sent to ollama again,
+#so an interrupted run is cheap to repeat
+def reembed_chunks(batch_size=INSERT_FLUSH_SIZE):
+    conn  = get_db_connection()
+    cur   = conn.cursor()
+    last  = None
+    count = 0
+    start = time.perf_counter()
+    try:
+        while True:
+            cur.execute("""
+              SELECT chunk_id::text, text FROM document_chunks
+              WHERE %(last)s::uuid IS NULL OR chunk_id > %(last)s::uuid
+              ORDER BY chunk_id
+              LIMIT %(limit)s;
+            """, {"last": last, "limit": batch_size})
+            rows = cur.fetchall()
+            if not rows:
+                break
+            updates = [(chunk_id, emb) for (chunk_id, _), emb in embed_paragraphs(rows, text_of=lambda row: row[1])]
+            execute_values(cur, """
+              UPDATE document_chunks AS d
+              SET embedding = v.embedding
+              FROM (VALUES %s) AS v(chunk_id, embedding)
+              WHERE d.chunk_id = v.chunk_id::uuid;
+            """, updates, template="(%s, %s::vector)", page_size=len(updates))
+            last   = rows[-1][0]
+            count += len(rows)
+    finally:
+        cur.close()
+        release_db_connection(conn)
+    print(f"Re-embedded {count} chunks in {time.perf_counter() - start:.1f}s")
+    if INDEX_TYPE == "ivfflat":
+        print("IVFFlat lists were trained on the old vectors; run: python Basic_RAG_Pipeline3.py rebuild-index")
+
+#sets the per-query search knob for the index type in use
+#hnsw.ef_search has to be at least top_n or the index can return fewer rows than asked for
+#filtered=True turns on iterative index scans, so a WHERE filter is applied while walking the index
+#instead of the index handing back ef_search rows that the filter then throws away
+#(search_settings returns them as (name, value) pairs, tune_search applies them on a cursor)
+def search_settings(top_n, ef_search=None, probes=None, filtered=False):
+    if INDEX_TYPE == "none":
+        return []
+    if INDEX_TYPE == "hnsw":
+        settings = [("hnsw.ef_search", max(ef_search or HNSW_EF_SEARCH, top_n))]
+    else:
+        settings = [("ivfflat.probes", probes or IVFFLAT_PROBES)]
+    iterative = iterative_scan_setting() if filtered else None
+    if iterative:
+        settings.append((iterative, ITERATIVE_SCAN))
+    return settings
+
+#SET lasts as long as the pooled connection's session, so an unfiltered search first
+#resets the iterative scan a filtered search on the same connection may have left on
+def tune_search(cur, top_n, ef_search=None, probes=None, filtered=False):
+    if not filtered and iterative_scan_setting():
+        cur.execute(f"RESET {iterative_scan_setting()};")
+    for name, value in search_settings(top_n, ef_search, probes, filtered):
+        cur.execute(f"SET {name} = %s;", (value,))
+
+#turns retrieval filters into a WHERE clause (and its named parameters)
+#filters is a dict with any of:
+#  document_id - one document ID or a list of them
+#  metadata    - a dict the chunk metadata must contain, e.g. {"page": 3}
+#  page_from / page_to - page range (inclusive)
+#returns ("", {}) when there is nothing to filter on
+def filter_sql(filters):
+    if not filters:
+        return "", {}
+    clauses, params = [], {}
+    document_id = filters.get("document_id")
+    if document_id:
+        ids = [document_id] if isinstance(document_id, str) else list(document_id)
+        clauses.append("document_id = ANY(%(f_document_ids)s)")
+        params["f_document_ids"] = ids
+    if filters.get("metadata"):
+        clauses.append("metadata @> %(f_metadata)s::jsonb")
+        params["f_metadata"] = json.dumps(filters["metadata"])
+    if filters.get("page_from") is not None:
+        clauses.append("(metadata->>'page')::int >= %(f_page_from)s")
+        params["f_page_from"] = filters["page_from"]
+    if filters.get("page_to") is not None:
+        clauses.append("(metadata->>'page')::int <= %(f_page_to)s")
+        params["f_page_to"] = filters["page_to"]
+    if not clauses:
+        return "", {}
+    return "WHERE " + " AND ".join(clauses), params
+
+#opens a PDF and returns the text of pages start..stop-1
+#runs inside a worker process when a big PDF is extracted in parallel
+def extract_page_range(pdf_path, start, stop):
+    doc = fitz.open(pdf_path)
+    pages = [doc[i].get_text("text") for i in range(start, stop)]
+    doc.close()
+    return pages
+
+#opens a PDF and yields (page_number, page_text) one page at a time, so the whole
+#document never has to sit in memory
+#big PDFs are split into page ranges that a process pool extracts in parallel;
+#only a few ranges are in flight at once and pages still come out in order
+def iter_pdf_pages(pdf_path, workers=PDF_WORKERS):
+    doc = fitz.open(pdf_path)
+    page_count = len(doc)
+    if page_count <= PDF_PARALLEL_PAGES or workers <= 1:
+        try:
+            for i, page in enumerate(doc):
+                yield i + 1, page.get_text("text")
+        finally:
+            doc.close()
+        return
+    doc.close()
+
+    in_flight = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, page_count, PDF_PAGES_PER_TASK):
+            if len(in_flight) >= workers * 2: #wait for the oldest range before submitting more
+                first, future = in_flight.popleft()
+                for offset, text in enumerate(future.result()):
+                    yield first + offset + 1, text
+            stop = min(start + PDF_PAGES_PER_TASK, page_count)
+            in_flight.append((start, pool.submit(extract_page_range, pdf_path, start, stop)))
+        while in_flight:
+            first, future = in_flight.popleft()
+            for offset, text in enumerate(future.result()):
+                yield first + offset + 1, text
 
 #opens a PDF
 #extracts the text from each page
-#returns all the text as one big string
+#returns all the text as one big string (use iter_pdf_pages to stream it instead)
 def extract_text_from_pdf(pdf_path):
-    doc = fitz.open(pdf_path)
-    text = ""
-    for page in doc:
-        text += page.get_text("text") + "\n\n"
-    doc.close()
-    return text
+    return "".join(text + "\n\n" for _, text in iter_pdf_pages(pdf_path))
+
+#turns a stream of (page_number, page_text) into a stream of (paragraph, metadata) chunks
+def iter_paragraphs(pages):
+    for page_no, text in pages:
+        for para in chunk_paragraphs(text):
+            yield para, {"page": page_no}
+
+#rough token count: words and punctuation marks count as one token each
+#(no tokenizer dependency; close enough to size chunks for the embedding model)
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+def count_tokens(text):
+    return len(TOKEN_PATTERN.findall(text))
+
+#splits a paragraph into sentences; PDF line breaks inside a paragraph are flattened first
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+def split_sentences(text):
+    text = " ".join(text.split())
+    return [s for s in SENTENCE_END.split(text) if s]
+
+#cuts a sentence that is longer than max_tokens into word runs of at most max_tokens
+def split_long_sentence(sentence, max_tokens):
+    piece, piece_tokens = [], 0
+    for word in sentence.split():
+        tokens = count_tokens(word)
+        if piece and piece_tokens + tokens > max_tokens:
+            yield " ".join(piece), piece_tokens
+            piece, piece_tokens = [], 0
+        piece.append(word)
+        piece_tokens += tokens
+    if piece:
+        yield " ".join(piece), piece_tokens
+
+#packs a stream of (paragraph, metadata) into chunks of about target_tokens
+#sentences are never cut unless a single sentence won't fit next to the overlap
+#tiny fragments (PDF headers, page numbers, ...) are merged until a chunk has at least min_tokens
+#the last overlap_tokens worth of sentences are repeated at the start of the next chunk
+#each chunk keeps the metadata of the paragraph its first new sentence came from
+def chunk_by_tokens(paragraphs, target_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS, min_tokens=CHUNK_MIN_TOKENS):
+    buffer, buffer_tokens = [], 0 #list of (sentence, tokens)
+    buffer_meta = None
+    fresh = False #does the buffer hold anything that wasn't already yielded?
+    max_piece = max(1, target_tokens - overlap_tokens)
+    for para, meta in paragraphs:
+        for sentence in split_sentences(para):
+            for piece, tokens in split_long_sentence(sentence, max_piece):
+                if fresh and buffer_tokens + tokens > target_tokens and buffer_tokens >= min_tokens:
+                    yield " ".join(s for s, _ in buffer), buffer_meta
+                    kept, kept_tokens = [], 0
+                    for s, t in reversed(buffer):
+                        if kept_tokens + t > overlap_tokens:
+                            break
+                        kept.insert(0, (s, t))
+                        kept_tokens += t
+                    buffer, buffer_tokens = kept, kept_tokens
+                    fresh = False
+                if not fresh:
+                    buffer_meta = meta
+                buffer.append((piece, tokens))
+                buffer_tokens += tokens
+                fresh = True
+    if fresh:
+        yield " ".join(s for s, _ in buffer), buffer_meta
+
+#the available chunkers; each takes and returns a stream of (text, metadata)
+CHUNKERS = {
+    "paragraph": lambda paragraphs: paragraphs,
+    "token": chunk_by_tokens,
+}
+
+#settings that change how a document is cut; part of the manifest hash so changing them re-chunks
+def chunker_signature(chunker):
+    if chunker == "token":
+        return f"token:{CHUNK_TOKENS}:{CHUNK_OVERLAP_TOKENS}:{CHUNK_MIN_TOKENS}"
+    return chunker
 
 #splits the text into paragraphs based on double newlines
 #removes any extra whitespace
 def chunk_paragraphs(text):
     return [p.strip() for p in text.split("\n\n") if p.strip()]
 
-#calls on ollama's embedding model to get the embeddings for the text
+#two-tier cache for embeddings, keyed by the embedding model and a hash of the text
+#tier 1 is an in-memory LRU, tier 2 is a SQLite file so embeddings survive restarts
+#both tiers are size bounded: the LRU drops its least recently used entry,
+#the disk tier deletes the least recently used 10% once it is over its limit
+#the LRU holds the vectors as array("f") (4 bytes per dimension, a list of floats takes about 32)
+#and hands out plain lists
+#repeated questions and boilerplate paragraphs (headers, footers, disclaimers) are only embedded once
+class EmbeddingCache:
+    def __init__(self, path, memory_size, disk_size):
+        self.memory_size = memory_size
+        self.disk_size   = disk_size
+        self.memory      = OrderedDict()
+        self.lock        = threading.Lock()
+        self.db          = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL;")
+        self.db.execute("""
+          CREATE TABLE IF NOT EXISTS embeddings (
+            key       TEXT PRIMARY KEY,
+            vector    BLOB NOT NULL,
+            last_used REAL NOT NULL
+          );
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);")
+        self.db.commit()
+        self.disk_count = self.db.execute("SELECT count(*) FROM embeddings;").fetchone()[0]
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    #"embed" marks vectors from /api/embed (normalized); entries from the older /api/embeddings
+    #path had no marker and are simply never looked up again
+    @staticmethod
+    def key(model, text):
+        return f"{model}:embed:{content_hash(text)}"
+
+    #returns one embedding per text, or None where the text isn't cached
+    def get_many(self, model, texts):
+        keys    = [self.key(model, t) for t in texts]
+        results = [None] * len(keys)
+        missing = {}
+        with self.lock:
+            for i, key in enumerate(keys):
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    results[i] = self.memory[key].tolist()
+                    self.stats["memory_hits"] += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+            if missing:
+                found = {}
+                key_list = list(missing)
+                for start in range(0, len(key_list), 500): #SQLite limits the number of ? parameters
+                    part = key_list[start:start + 500]
+                    marks = ",".join("?" * len(part))
+                    for key, blob in self.db.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({marks});", part):
+                        found[key] = array("f", blob)
+                if found:
+                    now = time.time()
+                    self.db.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?;", [(now, k) for k in found])
+                    self.db.commit()
+                for key, indexes in missing.items():
+                    vector = found.get(key)
+                    if vector is None:
+                        self.stats["misses"] += len(indexes)
+                        continue
+                    self.stats["disk_hits"] += len(indexes)
+                    self._remember(key, vector)
+                    for i in indexes:
+                        results[i] = vector.tolist()
+        return results
+
+    #stores freshly computed embeddings in both tiers
+    def put_many(self, model, texts, vectors):
+        now  = time.time()
+        rows = []
+        with self.lock:
+            for text, vector in zip(texts, vectors):
+                key = self.key(model, text)
+                packed = array("f", vector)
+                self._remember(key, packed)
+                rows.append((key, packed.tobytes(), now))
+            before = self.db.total_changes
+            self.db.executemany("INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?);", rows)
+            #other processes (ingest workers, uvicorn workers) write to the same file, so the rows are
+            #counted again here, inside the INSERT's write transaction, rather than tracked per process
+            if self.db.total_changes > before:
+                self.disk_count = self.db.execute("SELECT count(*) FROM embeddings;").fetchone()[0]
+            if self.disk_count > self.disk_size:
+                drop = self.disk_count - int(self.disk_size * 0.9)
+                self.db.execute("""
+                  DELETE FROM embeddings WHERE key IN (
+                    SELECT key FROM embeddings ORDER BY last_used LIMIT ?
+                  );
+                """, (drop,))
+                self.disk_count -= drop
+                self.stats["evictions"] += drop
+            self.db.commit()
+
+    #adds to the in-memory LRU, evicting the oldest entry when it is full (lock must be held)
+    def _remember(self, key, vector):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    #hit/miss counters plus the overall hit rate (shown in the sidebar)
+    def summary(self):
+        with self.lock:
+            lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+            hits    = lookups - self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                "memory_entries": len(self.memory),
+                "disk_entries": self.disk_count,
+            }
+
+#one cache per process, kept alive across Streamlit reruns
+@st.cache_resource
+def get_embedding_cache():
+    return EmbeddingCache(EMBED_CACHE_PATH, EMBED_CACHE_MEMORY_SIZE, EMBED_CACHE_DISK_SIZE)
+
+#calls on ollama's embedding model to get the embeddings for the text (unless it is cached)
 #returns the embedding (a list of numbers)
 def get_embedding(text: str):
-    resp = ollama.embeddings(model=EMBED_MODEL, prompt=text)
-    return resp["embedding"]
-
-#splits the PDF into paragraphs
-#generates embeddings for each paragraph
-#Inserts each chunk into PostgreSQL database
-#returns how many paragraphs were stored
-def store_document(document_id: str, text: str):
+    cache  = get_embedding_cache()
+    cached = cache.get_many(EMBED_MODEL, [text])[0]
+    if cached is not None:
+        return cached
+    #same endpoint as get_embeddings, so a text gets the same (normalized) vector either way
+    resp = ollama.embed(model=EMBED_MODEL, input=text)
+    cache.put_many(EMBED_MODEL, [text], resp["embeddings"])
+    return resp["embeddings"][0]
+
+#embeds a whole batch of texts with one request to ollama
+#texts that are already in the embedding cache are not sent
+#returns the embeddings in the same order as the texts
+def get_embeddings(texts):
+    texts   = list(texts)
+    cache   = get_embedding_cache()
+    results = cache.get_many(EMBED_MODEL, texts)
+    misses  = [i for i, emb in enumerate(results) if emb is None]
+    if misses:
+        miss_texts = [texts[i] for i in misses]
+        resp = ollama.embed(model=EMBED_MODEL, input=miss_texts)
+        cache.put_many(EMBED_MODEL, miss_texts, resp["embeddings"])
+        for i, emb in zip(misses, resp["embeddings"]):
+            results[i] = emb
+    return results
+
+#groups any iterable into lists of batch_size items (the last one can be smaller)
+def batched(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+#embeds paragraphs in batches using a pool of worker threads
+#only a limited number of batches are in flight at once (backpressure), so a big document
+#doesn't queue thousands of requests and pile up results in memory
+#yields (paragraph, embedding) pairs in the same order as the paragraphs came in
+#paras can also be other items (e.g. tuples) if text_of says how to get the text out of them
+#prints paragraphs/sec at the end so batch size and worker count can be tuned
+def embed_paragraphs(paras, batch_size=EMBED_BATCH_SIZE, workers=EMBED_WORKERS, text_of=None):
+    start     = time.perf_counter()
+    count     = 0
+    max_queue = workers * 2
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch in batched(paras, batch_size):
+            if len(in_flight) >= max_queue: #wait for the oldest batch before sending more
+                done_batch, future = in_flight.popleft()
+                count += len(done_batch)
+                yield from zip(done_batch, future.result())
+            texts = batch if text_of is None else [text_of(item) for item in batch]
+            in_flight.append((batch, pool.submit(get_embeddings, texts)))
+        while in_flight:
+            done_batch, future = in_flight.popleft()
+            count += len(done_batch)
+            yield from zip(done_batch, future.result())
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else 0.0
+    print(f"Embedded {count} paragraphs in {elapsed:.2f}s ({rate:.1f} paragraphs/sec, "
+          f"batch size {batch_size}, {workers} workers)")
+
+#writes a buffer of chunk rows with a single multi-row INSERT
+#each row is (chunk_id, document_id, text, metadata, embedding)
+def insert_chunks(cur, rows):
+    if not rows:
+        return
+    execute_values(cur, """
+      INSERT INTO document_chunks (chunk_id, document_id, text, metadata, embedding)
+      VALUES %s
+      ON CONFLICT (chunk_id) DO NOTHING;
+    """, rows, template="(%s, %s, %s, %s, %s::vector)", page_size=len(rows))
+
+#sha256 of a piece of text (or raw bytes, e.g. the uploaded PDF file)
+def content_hash(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+#chunk IDs are derived from the document and the paragraph's content instead of being random,
+#so the same paragraph always gets the same ID and re-ingesting it hits ON CONFLICT
+#occurrence tells apart a paragraph that shows up several times in the same document
+CHUNK_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "document_chunks")
+
+def make_chunk_id(document_id, para, occurrence=0):
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{document_id}\x00{content_hash(para)}\x00{occurrence}"))
+
+#fixes up chunk_index for paragraphs that were kept but moved around in a changed document
+def update_chunk_metadata(cur, updates):
+    if not updates:
+        return
+    execute_values(cur, """
+      UPDATE document_chunks AS d
+      SET metadata = v.metadata::jsonb
+      FROM (VALUES %s) AS v(chunk_id, metadata)
+      WHERE d.chunk_id = v.chunk_id::uuid;
+    """, updates, page_size=len(updates))
+
+#wraps an iterator and adds the time spent waiting for its items to stats[seconds_key]
+#(and the number of items to stats[count_key]); the time includes everything upstream of it
+def timed(items, stats, seconds_key, count_key=None):
+    stats.setdefault(seconds_key, 0.0)
+    if count_key:
+        stats.setdefault(count_key, 0)
+    items = iter(items)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(items)
+        except StopIteration:
+            stats[seconds_key] += time.perf_counter() - start
+            return
+        stats[seconds_key] += time.perf_counter() - start
+        if count_key:
+            stats[count_key] += 1
+        yield item
+
+#stores a stream of (paragraph, metadata) for a document, cut into chunks by the chosen chunker
+#checks the document manifest first: if doc_hash (and the chunker settings) haven't changed there is nothing to do
+#(the chunks aren't even read, so an unchanged PDF isn't extracted)
+#otherwise only chunks whose chunk ID isn't stored yet are embedded (see embed_paragraphs)
+#and chunks that disappeared from the document are deleted
+#chunks flow straight from the extractor through embedding into the INSERT buffer,
+#which is flushed INSERT_FLUSH_SIZE rows at a time, so memory stays flat for big PDFs
+#everything for one document is written in a single transaction
+#stats (a dict, optional) gets chunks / rows counts and the seconds spent in each stage
+#(extract_seconds is filled in by the caller, e.g. store_pdf; stages overlap, so the split is approximate)
+#returns how many new chunks were stored
+def store_chunks(document_id: str, paragraphs, doc_hash: str, chunker: str = CHUNKER, flush_size: int = INSERT_FLUSH_SIZE, stats: dict = None):
+    stats = {} if stats is None else stats
+    for key in ("chunks", "rows"):
+        stats.setdefault(key, 0)
+    for key in ("extract_seconds", "chunk_seconds", "embed_seconds", "insert_seconds"):
+        stats.setdefault(key, 0.0)
+    extract_before = stats["extract_seconds"] #stats can be shared by several documents
+    doc_hash = content_hash(f"{doc_hash}:{chunker_signature(chunker)}")
+    chunk_wait, embed_wait = {}, {} #waiting times that include the upstream stages
+    chunks   = timed(CHUNKERS[chunker](paragraphs), chunk_wait, "seconds")
     conn = get_db_connection()
+    conn.autocommit = False #one transaction for the whole document
     cur  = conn.cursor()
-    paras = chunk_paragraphs(text)
-    for idx, para in enumerate(paras):
-        emb = get_embedding(para)
+    try:
+        #two uploads of the same document at the same time wait for each other here
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (document_id,))
+        cur.execute("SELECT content_hash FROM document_manifest WHERE document_id = %s;", (document_id,))
+        row = cur.fetchone()
+        if row and row[0] == doc_hash:
+            conn.commit()
+            return 0 #unchanged document, nothing to embed or write
+
+        cur.execute("SELECT chunk_id FROM document_chunks WHERE document_id = %s;", (document_id,))
+        existing = {str(r[0]) for r in cur.fetchall()}
+
+        occurrences = {} #content hash -> times seen, so memory doesn't hold the paragraph text
+        current     = set()
+        updates     = []
+        counts      = {"total": 0, "new": 0}
+
+        #walks the chunks once, remembering the kept ones and passing the new ones on
+        def new_chunks():
+            for idx, (para, meta) in enumerate(chunks):
+                para_hash  = content_hash(para)
+                occurrence = occurrences.get(para_hash, 0)
+                occurrences[para_hash] = occurrence + 1
+                chunk_id = make_chunk_id(document_id, para, occurrence)
+                current.add(chunk_id)
+                metadata = json.dumps({"chunk_index": idx, **meta})
+                counts["total"] += 1
+                if chunk_id in existing:
+                    updates.append((chunk_id, metadata))
+                else:
+                    counts["new"] += 1
+                    yield chunk_id, para, metadata
+
+        #writes the buffer and keeps track of the insert time
+        def flush(rows):
+            start = time.perf_counter()
+            insert_chunks(cur, rows)
+            stats["insert_seconds"] += time.perf_counter() - start
+            stats["rows"] += len(rows)
+
+        rows = []
+        embedded = timed(embed_paragraphs(new_chunks(), text_of=lambda chunk: chunk[1]), embed_wait, "seconds")
+        for (chunk_id, para, metadata), emb in embedded:
+            rows.append((chunk_id, document_id, para, metadata, emb))
+            if len(rows) >= flush_size:
+                flush(rows)
+                rows = []
+        flush(rows)
+        stats["chunks"] += counts["total"]
+        #each wait includes the stages before it, so subtract those back out
+        extracted = stats["extract_seconds"] - extract_before
+        stats["chunk_seconds"] += max(0.0, chunk_wait.get("seconds", 0.0) - extracted)
+        stats["embed_seconds"] += max(0.0, embed_wait.get("seconds", 0.0) - chunk_wait.get("seconds", 0.0))
+
+        removed = list(existing - current)
+        if removed:
+            cur.execute("DELETE FROM document_chunks WHERE chunk_id = ANY(%s::uuid[]);", (removed,))
+        update_chunk_metadata(cur, updates)
         cur.execute("""
-          INSERT INTO document_chunks (chunk_id, document_id, text, metadata, embedding)
-          VALUES (%s, %s, %s, %s, %s)
-          ON CONFLICT (chunk_id) DO NOTHING;
-        """, (
-          str(uuid.uuid4()),
-          document_id,
-          para,
-          json.dumps({"chunk_index": idx}),
-          emb
-        ))
-    conn.commit()
-    cur.close()
-    conn.close()
-    return len(paras)
+          INSERT INTO document_manifest (document_id, content_hash, chunk_count, updated_at)
+          VALUES (%s, %s, %s, now())
+          ON CONFLICT (document_id) DO UPDATE
+          SET content_hash = EXCLUDED.content_hash,
+              chunk_count  = EXCLUDED.chunk_count,
+              updated_at   = EXCLUDED.updated_at;
+        """, (document_id, doc_hash, counts["total"]))
+        conn.commit()
+    except Exception:
+        conn.rollback() #don't leave half a document behind
+        raise
+    finally:
+        cur.close()
+        release_db_connection(conn)
+    if counts["new"] or removed:
+        get_answer_cache().invalidate_document(document_id) #cached answers built on the old chunks
+    return counts["new"]
+
+#splits the text into paragraphs and stores them as chunks (see store_chunks)
+#doc_hash can be passed in (e.g. hash of the PDF bytes), otherwise the text is hashed
+#returns how many new paragraphs were stored
+def store_document(document_id: str, text: str, doc_hash: str = None, chunker: str = CHUNKER, flush_size: int = INSERT_FLUSH_SIZE, stats: dict = None):
+    paragraphs = ((para, {}) for para in chunk_paragraphs(text))
+    return store_chunks(document_id, paragraphs, doc_hash or content_hash(text), chunker, flush_size, stats)
+
+#opens a PDF and streams it page by page into store_chunks
+#pdf_workers=1 keeps extraction in this process (e.g. when the caller is already a worker process)
+#stats also gets the page count and extract_seconds (see store_chunks)
+#returns how many new paragraphs were stored
+def store_pdf(document_id: str, pdf_path: str, doc_hash: str = None, chunker: str = CHUNKER, flush_size: int = INSERT_FLUSH_SIZE, stats: dict = None, pdf_workers: int = PDF_WORKERS):
+    if doc_hash is None:
+        with open(pdf_path, "rb") as f:
+            doc_hash = content_hash(f.read())
+    stats = {} if stats is None else stats
+    pages = timed(iter_pdf_pages(pdf_path, pdf_workers), stats, "extract_seconds", "pages")
+    return store_chunks(document_id, iter_paragraphs(pages), doc_hash, chunker, flush_size, stats)
+
+#builds the nearest neighbour query for an embedding: returns (sql, named parameters)
+#each row is (text, metadata, distance, chunk_id, document_id)
+#filters (see filter_sql) are applied inside the index scan, not on the top N afterwards
+#the MATERIALIZED CTE puts rows back in exact order in case the iterative scan relaxed it
+#in a quantized layout the top N is re-ranked from compact-index candidates (see nearest_sql)
+def search_chunks_query(q_emb, top_n, filters=None, quantization=QUANTIZATION):
+    where, params = filter_sql(filters)
+    sql = f"""
+      WITH hits AS MATERIALIZED ({nearest_sql("text, metadata, chunk_id, document_id", where, "%(top_n)s", quantization)}
+      )
+      SELECT text, metadata, distance AS similarity, chunk_id, document_id
+      FROM hits
+      ORDER BY distance;
+    """
+    return sql, {"q_emb": q_emb, "top_n": top_n, **params}
+
+#runs the nearest neighbour query for an embedding and returns the rows (see search_chunks_query)
+#exact=True turns off index scans so the result is the true top N (used to measure recall)
+def search_chunks(cur, q_emb, top_n, ef_search=None, probes=None, exact=False, filters=None, quantization=QUANTIZATION):
+    if exact:
+        quantization = "none" #exact means full precision over every row
+    sql, params = search_chunks_query(q_emb, top_n, filters, quantization)
+    tune_search(cur, first_pass_size(top_n, quantization), ef_search, probes, filtered=bool(filter_sql(filters)[0]))
+    if exact:
+        cur.execute("SET enable_indexscan = off;")
+    try:
+        cur.execute(sql, params)
+        return cur.fetchall()
+    finally:
+        if exact:
+            cur.execute("RESET enable_indexscan;")
 
 #Turns the query into an embedding
-#Searches PostgreSQL using <-> operator to find the top N most similar chunks
+#Searches PostgreSQL using the DISTANCE_OP operator (through the ANN index) to find the top N most similar chunks
+#ef_search / probes override the index search settings for this one query
+#q_emb can be passed in when the caller already embedded the query
+#filters scope the search to documents / metadata (see filter_sql)
 #Gets the top N most similar chunks and returns them
-def retrieve_similar(query: str, top_n: int = 5):
-    q_emb = get_embedding(query)
+def retrieve_similar(query: str, top_n: int = 5, ef_search=None, probes=None, q_emb=None, filters=None):
+    q_emb = get_embedding(query) if q_emb is None else q_emb
     conn = get_db_connection()
     cur  = conn.cursor()
-    cur.execute(f"""
-      SELECT text, metadata, embedding <-> %s::vector AS similarity
-      FROM document_chunks
-      ORDER BY similarity
-      LIMIT %s;
-    """, (q_emb, top_n))
-    rows = cur.fetchall()
+    rows = search_chunks(cur, q_emb, top_n, ef_search, probes, filters=filters)
     cur.close()
-    conn.close()
+    release_db_connection(conn)
     return rows
 
-#Retrieves the most similar chunks for the question
-#Creates a variable 'context' that contains the text of the most similar chunks
+#builds the hybrid query: the vector search and the full-text search run in one SQL round trip
+#and are fused; returns (sql, named parameters)
+#each retriever contributes its best `candidates` rows; reciprocal rank fusion adds up
+#1 / (RRF_K + rank) from each list, so a chunk that both retrievers like comes out on top
+#and an exact keyword hit (part numbers, error codes) still gets in even if its embedding is far away
+#each row is (text, metadata, rrf_score, chunk_id, document_id, vector_rank, text_rank)
+#a rank is None when that retriever didn't return the chunk
+#filters (see filter_sql) apply to both retrievers
+def search_hybrid_query(q_emb, query, top_n, candidates, filters=None):
+    where, params = filter_sql(filters)
+    text_where = f"{where} AND text_tsv @@ query" if where else "WHERE text_tsv @@ query"
+    sql = f"""
+      WITH vector_hits AS (
+        SELECT chunk_id, row_number() OVER (ORDER BY distance) AS rank
+        FROM ({nearest_sql("chunk_id", where, "%(candidates)s")}
+        ) AS v
+      ),
+      text_hits AS (
+        SELECT chunk_id, row_number() OVER (ORDER BY text_score DESC) AS rank
+        FROM (
+          SELECT chunk_id, ts_rank_cd(text_tsv, query) AS text_score
+          FROM document_chunks, websearch_to_tsquery('{TEXT_SEARCH_CONFIG}', %(query)s) AS query
+          {text_where}
+          ORDER BY text_score DESC
+          LIMIT %(candidates)s
+        ) AS t
+      ),
+      fused AS (
+        SELECT chunk_id,
+               v.rank AS vector_rank,
+               t.rank AS text_rank,
+               COALESCE(1.0 / (%(rrf_k)s + v.rank), 0) + COALESCE(1.0 / (%(rrf_k)s + t.rank), 0) AS score
+        FROM vector_hits AS v
+        FULL OUTER JOIN text_hits AS t USING (chunk_id)
+      )
+      SELECT d.text, d.metadata, f.score, d.chunk_id, d.document_id, f.vector_rank, f.text_rank
+      FROM fused AS f
+      JOIN document_chunks AS d USING (chunk_id)
+      ORDER BY f.score DESC
+      LIMIT %(top_n)s;
+    """
+    return sql, {"q_emb": q_emb, "query": query, "candidates": candidates, "rrf_k": RRF_K, "top_n": top_n, **params}
+
+#runs the hybrid query (see search_hybrid_query) and returns the rows
+def search_hybrid(cur, q_emb, query, top_n, candidates=None, ef_search=None, probes=None, filters=None):
+    candidates = max(candidates or HYBRID_CANDIDATES, top_n)
+    sql, params = search_hybrid_query(q_emb, query, top_n, candidates, filters)
+    tune_search(cur, first_pass_size(candidates), ef_search, probes, filtered=bool(filter_sql(filters)[0]))
+    cur.execute(sql, params)
+    return cur.fetchall()
+
+#hybrid version of retrieve_similar (see search_hybrid)
+def retrieve_hybrid(query: str, top_n: int = 5, candidates=None, ef_search=None, probes=None, q_emb=None, filters=None):
+    q_emb = get_embedding(query) if q_emb is None else q_emb
+    conn = get_db_connection()
+    cur  = conn.cursor()
+    rows = search_hybrid(cur, q_emb, query, top_n, candidates, ef_search, probes, filters)
+    cur.close()
+    release_db_connection(conn)
+    return rows
+
+#compares the storage layouts whose index exists (see migrate_quantization with keep_old)
+#for each: index size, embedding bytes per row, queries/sec and recall@top_n against exact search
+#stored chunk embeddings are used as sample queries
+def quantization_report(sample_size=50, top_n=10):
+    conn = get_db_connection()
+    cur  = conn.cursor()
+    cur.execute("SELECT embedding FROM document_chunks ORDER BY random() LIMIT %s;", (sample_size,))
+    samples = [row[0] for row in cur.fetchall()]
+    if not samples:
+        print("document_chunks is empty, nothing to measure")
+        cur.close()
+        release_db_connection(conn)
+        return []
+    truth = [{r[3] for r in search_chunks(cur, q_emb, top_n, exact=True)} for q_emb in samples]
+
+    #average stored size of one embedding in each layout
+    cur.execute(f"""
+      SELECT avg(pg_column_size(embedding)),
+             avg(pg_column_size(embedding::halfvec({TABLE_DIM}))),
+             avg(pg_column_size(binary_quantize(embedding)::bit({TABLE_DIM})))
+      FROM (SELECT embedding FROM document_chunks LIMIT 1000) AS s;
+    """)
+    row_bytes = dict(zip(("none", "halfvec", "binary"), (round(float(b)) for b in cur.fetchone())))
+
+    report = []
+    for quantization in ("none", "halfvec", "binary"):
+        cur.execute("SELECT pg_relation_size(to_regclass(%s));", (index_name(quantization),))
+        index_bytes = cur.fetchone()[0]
+        if index_bytes is None:
+            continue #no index for this layout
+        hits  = 0
+        start = time.perf_counter()
+        for q_emb, expected in zip(samples, truth):
+            hits += len(expected & {r[3] for r in search_chunks(cur, q_emb, top_n, quantization=quantization)})
+        elapsed = time.perf_counter() - start
+        report.append({
+            "layout": quantization,
+            "index_mb": round(index_bytes / 1024 / 1024, 1),
+            "bytes_per_vector": row_bytes[quantization],
+            "qps": round(len(samples) / elapsed, 1),
+            "recall": round(hits / sum(len(t) for t in truth), 3),
+        })
+    cur.close()
+    release_db_connection(conn)
+
+    print(f"recall@{top_n} over {len(samples)} sample queries ({INDEX_TYPE}, {DISTANCE_OP}, overfetch x{QUANT_OVERFETCH})")
+    for r in report:
+        print(f"  {r['layout']:<8} index={r['index_mb']} MB  vector={r['bytes_per_vector']} B  "
+              f"qps={r['qps']}  recall={r['recall']}")
+    return report
+
+#picks the retriever for the given mode ("vector" or "hybrid")
+def retrieve(query: str, top_n: int = 5, mode: str = RETRIEVAL_MODE, q_emb=None, filters=None):
+    if mode == "hybrid":
+        return retrieve_hybrid(query, top_n, q_emb=q_emb, filters=filters)
+    return retrieve_similar(query, top_n, q_emb=q_emb, filters=filters)
+
+#lists the stored documents (for the "search in" picker)
+def list_documents():
+    conn = get_db_connection()
+    cur  = conn.cursor()
+    cur.execute("SELECT document_id FROM document_manifest ORDER BY document_id;")
+    documents = [r[0] for r in cur.fetchall()]
+    cur.close()
+    release_db_connection(conn)
+    return documents
+
+#compares the ANN index against exact search for a range of ef_search / probes values
+#stored chunk embeddings are used as sample queries so no embedding calls are needed
+#prints and returns recall@top_n and average latency for each setting
+def index_recall_report(sample_size=20, top_n=10, settings=None):
+    if settings is None:
+        settings = [10, 20, 40, 80, 160, 320] if INDEX_TYPE == "hnsw" else [1, 2, 5, 10, 20, 50]
+    conn = get_db_connection()
+    cur  = conn.cursor()
+    cur.execute("SELECT embedding FROM document_chunks ORDER BY random() LIMIT %s;", (sample_size,))
+    samples = [row[0] for row in cur.fetchall()]
+    if not samples:
+        print("document_chunks is empty, nothing to measure")
+        cur.close()
+        release_db_connection(conn)
+        return []
+
+    exact_results = []
+    start = time.perf_counter()
+    for q_emb in samples:
+        exact_results.append({r[3] for r in search_chunks(cur, q_emb, top_n, exact=True)})
+    exact_ms = (time.perf_counter() - start) * 1000 / len(samples)
+
+    report = [{"setting": "exact", "recall": 1.0, "avg_ms": round(exact_ms, 2)}]
+    for value in settings:
+        hits  = 0
+        start = time.perf_counter()
+        for q_emb, truth in zip(samples, exact_results):
+            if INDEX_TYPE == "hnsw":
+                rows = search_chunks(cur, q_emb, top_n, ef_search=value)
+            else:
+                rows = search_chunks(cur, q_emb, top_n, probes=value)
+            hits += len(truth & {r[3] for r in rows})
+        avg_ms = (time.perf_counter() - start) * 1000 / len(samples)
+        name = "ef_search" if INDEX_TYPE == "hnsw" else "probes"
+        report.append({
+            "setting": f"{name}={value}",
+            "recall": round(hits / sum(len(t) for t in exact_results), 3),
+            "avg_ms": round(avg_ms, 2),
+        })
+    cur.close()
+    release_db_connection(conn)
+
+    print(f"recall@{top_n} over {len(samples)} sample queries ({INDEX_TYPE}, {DISTANCE_OP})")
+    for row in report:
+        print(f"  {row['setting']:<16} recall={row['recall']:<6} avg={row['avg_ms']} ms")
+    return report
+
+#remembers answers by the question's embedding so near-identical questions skip generation
+#an entry is only reused if the new question is similar enough AND its retrieval returned exactly
+#the same chunks (so new or changed documents never give a stale answer)
+#entries expire after ttl seconds; when full the least recently used entry is dropped
+#entries that used a document are dropped when that document is stored again (invalidate_document)
+class SemanticAnswerCache:
+    def __init__(self, threshold, ttl, max_size):
+        self.threshold = threshold
+        self.ttl       = ttl
+        self.max_size  = max_size
+        self.entries   = OrderedDict() #id -> entry dict
+        self.next_id   = 0
+        self.lock      = threading.Lock()
+        self.stats     = {"hits": 0, "misses": 0, "expired": 0, "invalidated": 0, "evicted": 0}
+
+    @staticmethod
+    def normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    #returns the cached answer, or None
+    #settings holds whatever else has to match (model, retrieval mode, top_n)
+    def lookup(self, q_emb, chunk_ids, settings):
+        vector = self.normalize(q_emb)
+        now    = time.time()
+        with self.lock:
+            best_id, best_score = None, self.threshold
+            for entry_id, entry in list(self.entries.items()):
+                if now - entry["created"] > self.ttl:
+                    del self.entries[entry_id]
+                    self.stats["expired"] += 1
+                    continue
+                if entry["settings"] != settings or entry["chunk_ids"] != chunk_ids:
+                    continue
+                score = float(vector @ entry["embedding"])
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(best_id)
+            self.stats["hits"] += 1
+            return self.entries[best_id]["answer"]
+
+    def store(self, q_emb, chunk_ids, document_ids, settings, answer):
+        with self.lock:
+            self.entries[self.next_id] = {
+                "embedding": self.normalize(q_emb),
+                "chunk_ids": chunk_ids,
+                "documents": set(document_ids),
+                "settings": settings,
+                "answer": answer,
+                "created": time.time(),
+            }
+            self.next_id += 1
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.stats["evicted"] += 1
+
+    def invalidate_document(self, document_id):
+        with self.lock:
+            stale = [i for i, e in self.entries.items() if document_id in e["documents"]]
+            for entry_id in stale:
+                del self.entries[entry_id]
+            self.stats["invalidated"] += len(stale)
+
+    #hit/miss counters plus the hit rate (shown in the sidebar)
+    def summary(self):
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+                "entries": len(self.entries),
+            }
+
+#one answer cache per process, kept alive across Streamlit reruns
+@st.cache_resource
+def get_answer_cache():
+    return SemanticAnswerCache(ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL, ANSWER_CACHE_SIZE)
+
+#scores retrieved rows against the question with a local model and keeps the best `keep`
+#all candidates go to the model in a single request that asks for one 0-10 score per passage as JSON
+#if the model's reply can't be used the retrieval order is kept, so re-ranking can only help
+#returns (rows, seconds spent re-ranking)
+def rerank(question, rows, keep, model=RERANK_MODEL):
+    start = time.perf_counter()
+    if len(rows) <= keep:
+        return rows, 0.0
+    passages = "\n\n".join(f"[{i}] {r[0][:RERANK_MAX_CHARS]}" for i, r in enumerate(rows))
+    prompt = (
+        "Rate how useful each passage is for answering the question, from 0 (useless) to 10 (answers it).\n\n"
+        f"QUESTION: {question}\n\n"
+        f"PASSAGES:\n{passages}\n\n"
+        f'Reply with JSON only: {{"scores": [one number per passage, in order]}} ({len(rows)} numbers)'
+    )
+    #the default context window (2048) is smaller than RERANK_CANDIDATES long passages, and a truncated
+    #prompt gives the wrong number of scores; count_tokens undercounts model tokens, hence the margin,
+    #and rounding up to a power of two keeps Ollama from reloading the model for every new size
+    needed  = int(count_tokens(prompt) * 1.5) + 256 #+ room for the scores
+    num_ctx = max(2048, 1 << (needed - 1).bit_length())
+    try:
+        resp   = ollama.generate(model=model, prompt=prompt, format="json", options={"temperature": 0, "num_ctx": num_ctx})
+        scores = [float(x) for x in json.loads(resp["response"])["scores"]]
+        if len(scores) != len(rows):
+            raise ValueError(f"expected {len(rows)} scores, got {len(scores)}")
+    except (ValueError, KeyError, TypeError, ollama.ResponseError) as e:
+        print(f"Re-ranking failed, keeping retrieval order: {e}")
+        return rows[:keep], time.perf_counter() - start
+    #sorted() is stable, so ties keep their retrieval order
+    order = sorted(range(len(rows)), key=lambda i: -scores[i])
+    return [rows[i] for i in order[:keep]], time.perf_counter() - start
+
+#packs retrieved rows into the context token budget, most relevant first (rows come in relevance order)
+#near-duplicates (word-set Jaccard similarity >= dedup_threshold with a row already picked) are dropped
+#the last row that doesn't fit whole is cut to the tokens that are left, as long as that's a useful amount
+#returns (rows, info) where info has the token counts and how many rows were dropped and why
+def pack_context(rows, budget=CONTEXT_TOKEN_BUDGET, dedup_threshold=DEDUP_THRESHOLD):
+    packed, kept_words = [], []
+    used = 0
+    info = {"dropped_duplicates": 0, "dropped_budget": 0, "truncated": 0}
+    for row in rows:
+        words = set(row[0].lower().split())
+        if any(len(words & other) / max(len(words | other), 1) >= dedup_threshold for other in kept_words):
+            info["dropped_duplicates"] += 1
+            continue
+        tokens = count_tokens(row[0])
+        remaining = budget - used
+        if tokens <= remaining:
+            packed.append(row)
+            used += tokens
+        elif remaining >= min(CHUNK_MIN_TOKENS, tokens) and remaining > 0:
+            text, cut_tokens = next(split_long_sentence(row[0], remaining))
+            packed.append((text,) + tuple(row[1:]))
+            used += cut_tokens
+            info["truncated"] += 1
+        else:
+            info["dropped_budget"] += 1
+            continue
+        kept_words.append(words)
+    info["context_tokens"] = used
+    return packed, info
+
+#Creates a variable 'context' that contains the text of the retrieved chunks
 #Creates a prompt for the LLM that includes the context and the question
-#Calls the LLM to generate and return the answer based on the prompt provided
-def answer_question(question: str, top_n: int = 5):
-    results = retrieve_similar(question, top_n)
-    if not results:
-        return " No context found for that question."
+def build_prompt(question, results):
     context = "\n\n".join(r[0] for r in results)
-    prompt  = (
+    return (
         "You are a helpful assistant. "
         "Answer the question using ONLY the context below.\n\n"
         f"CONTEXT:\n{context}\n\n"
         f"QUESTION: {question}\n\n"
         "Answer:"
     )
-    resp = ollama.generate(model=LLM_MODEL, prompt=prompt)
-    return resp["response"].strip()
+
+#turns retrieved rows into the prompt: re-ranks them (if rerank_model is set), packs them into
+#the token budget and builds the prompt; the sizes and re-rank time go into timings
+#returns (prompt, rows that went into the prompt)
+def prepare_prompt(question, results, top_n, rerank_model, timings):
+    if rerank_model:
+        candidates     = len(results)
+        context_before = sum(len(r[0]) for r in results)
+        results, timings["rerank_seconds"] = rerank(question, results, top_n, rerank_model)
+        timings["rerank_candidates"] = candidates
+        timings["context_chars_before_rerank"] = context_before
+        timings["context_chars"] = sum(len(r[0]) for r in results)
+        print(f"Re-ranked {candidates} candidates with {rerank_model} in {timings['rerank_seconds']:.2f}s, "
+              f"kept {len(results)} (context {context_before} -> {timings['context_chars']} chars)")
+
+    #keeps the prompt inside the token budget and drops near-duplicate chunks
+    results, packing = pack_context(results)
+    prompt = build_prompt(question, results)
+    timings["prompt_tokens"]  = count_tokens(prompt)
+    timings["context_tokens"] = packing["context_tokens"]
+    print(f"Prompt: {timings['prompt_tokens']} tokens ({packing['context_tokens']} of context from {len(results)} chunks, "
+          f"dropped {packing['dropped_duplicates']} near-duplicates and {packing['dropped_budget']} over the "
+          f"{CONTEXT_TOKEN_BUDGET}-token budget, truncated {packing['truncated']})")
+    return prompt, results
+
+#Retrieves the most similar chunks for the question (vector or hybrid, see retrieve) and builds the prompt
+#Calls the LLM with stream=True and yields the answer piece by piece as the tokens arrive
+#timings (a dict, optional) gets filled with retrieve_seconds, first_token_seconds
+#(measured from the start of the question, i.e. what the user waits before seeing anything),
+#generate_seconds, total_seconds and prompt_tokens / context_tokens (to line prompt size up with generation time)
+#sources (a list, optional) gets the retrieved rows so the UI can show them
+#filters scope retrieval to documents / pages (see filter_sql)
+#rerank_model (defaults to RERANK_MODEL, "" turns it off) over-fetches RERANK_CANDIDATES chunks and
+#keeps the top_n best scored ones; timings then also gets rerank_seconds and the context size before/after
+def stream_answer(question: str, top_n: int = 5, timings: dict = None, mode: str = RETRIEVAL_MODE, sources: list = None, filters: dict = None, rerank_model: str = RERANK_MODEL):
+    timings = {} if timings is None else timings
+    start   = time.perf_counter()
+    q_emb   = get_embedding(question)
+    fetch   = max(RERANK_CANDIDATES, top_n) if rerank_model else top_n
+    results = retrieve(question, fetch, mode, q_emb=q_emb, filters=filters)
+    timings["retrieve_seconds"] = time.perf_counter() - start
+    if not results:
+        yield " No context found for that question."
+        return
+
+    #a near-identical earlier question with the same retrieved chunks already has an answer
+    #(checked before re-ranking, so a hit skips the re-rank call as well)
+    cache     = get_answer_cache()
+    chunk_ids = frozenset(str(r[3]) for r in results)
+    settings  = (LLM_MODEL, mode, top_n, json.dumps(filters, sort_keys=True), rerank_model)
+    cached    = cache.lookup(q_emb, chunk_ids, settings)
+    if cached is not None:
+        if sources is not None:
+            sources.extend(results[:top_n])
+        timings["first_token_seconds"] = timings["total_seconds"] = time.perf_counter() - start
+        timings["generate_seconds"] = 0.0
+        timings["cache_hit"] = 1
+        print(f"Answered from the semantic cache in {timings['total_seconds']:.2f}s")
+        yield cached
+        return
+
+    prompt, results = prepare_prompt(question, results, top_n, rerank_model, timings)
+    if sources is not None:
+        sources.extend(results)
+    generate_start = time.perf_counter()
+    parts = []
+    for part in ollama.generate(model=LLM_MODEL, prompt=prompt, stream=True):
+        token = part["response"]
+        if token and "first_token_seconds" not in timings:
+            timings["first_token_seconds"] = time.perf_counter() - start
+        parts.append(token)
+        yield token
+    cache.store(q_emb, chunk_ids, {r[4] for r in results}, settings, "".join(parts))
+    timings["generate_seconds"] = time.perf_counter() - generate_start
+    timings["total_seconds"]    = time.perf_counter() - start
+    print(f"Answered in {timings['total_seconds']:.2f}s with a {timings['prompt_tokens']}-token prompt "
+          f"(retrieve {timings['retrieve_seconds']:.2f}s, "
+          f"re-rank {timings.get('rerank_seconds', 0.0):.2f}s, "
+          f"first token {timings.get('first_token_seconds', timings['total_seconds']):.2f}s, "
+          f"generate {timings['generate_seconds']:.2f}s)")
+
+#Returns the whole answer as one string (same as stream_answer, without the streaming)
+def answer_question(question: str, top_n: int = 5, timings: dict = None, mode: str = RETRIEVAL_MODE, filters: dict = None, rerank_model: str = RERANK_MODEL):
+    return "".join(stream_answer(question, top_n, timings, mode, filters=filters, rerank_model=rerank_model)).strip()
+
+#one HTTP session to the service per process, so requests reuse the connection
+@st.cache_resource
+def get_service_session():
+    return requests.Session()
+
+#uploads a PDF to the service; it is stored in the background, returns the job ID
+def service_submit(document_id, pdf_bytes):
+    resp = get_service_session().post(f"{RAG_SERVICE_URL}/ingest", params={"document_id": document_id}, data=pdf_bytes,
+                                      headers={"Content-Type": "application/pdf"}, timeout=RAG_SERVICE_TIMEOUT)
+    resp.raise_for_status()
+    return resp.json()["job_id"]
+
+#one look at an ingestion job (queued / running / done / failed), without waiting for it
+def service_job(job_id):
+    resp = get_service_session().get(f"{RAG_SERVICE_URL}/jobs/{job_id}", timeout=RAG_SERVICE_TIMEOUT)
+    resp.raise_for_status()
+    return resp.json()
+
+#service version of stream_answer: yields the tokens as the service streams them,
+#then fills timings and sources from its last line
+def service_stream_answer(question, top_n, timings, mode, sources, filters, rerank):
+    body = {"question": question, "top_n": top_n, "mode": mode, "filters": filters, "rerank": rerank, "stream": True}
+    with get_service_session().post(f"{RAG_SERVICE_URL}/ask", json=body, stream=True,
+                                    timeout=(RAG_SERVICE_TIMEOUT, RAG_SERVICE_ANSWER_TIMEOUT)) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            if event.get("done"):
+                timings.update(event["timings"])
+                sources.extend(event["sources"])
+            else:
+                yield event["token"]
+
+def service_documents():
+    resp = get_service_session().get(f"{RAG_SERVICE_URL}/documents", timeout=RAG_SERVICE_TIMEOUT)
+    resp.raise_for_status()
+    return [d["document_id"] for d in resp.json()["documents"]]
 
 # Creates the streamlit web UI
 # Uploads PDF and saves it as a temporaty file so fitz can read it
@@ -151,41 +1547,144 @@ def answer_question(question: str, top_n: int = 5):
 def main():
     st.title("PDF Q&A with Ollama + PostgreSQL")
 
-    ensure_schema()
+    #with a service the schema is its job, this page only talks HTTP
+    if not RAG_SERVICE_URL:
+        ensure_schema()
 
     # Instead of typing the file path, the user uploads the PDF in their browser
     #We save it as a temporary file so the rest of the code can still use it
     pdf_file = st.file_uploader("Upload a PDF", type="pdf")
     if pdf_file:
-        pdf_path = f"temp_{pdf_file.name}"
+        pdf_path  = f"temp_{pdf_file.name}"
+        pdf_bytes = pdf_file.getvalue()
         with open(pdf_path, "wb") as f:
-            f.write(pdf_file.read()) 
-        with st.spinner("Extracting text from PDF..."): #Show status while extracting text
-            pdf_text = extract_text_from_pdf(pdf_path) #uses the function to store the text in 'text' variable
-        with st.spinner("Storing chunks and embeddings..."): #Shows status while storing data
-        #Streamlit will not display the text directly in the terminal, but it will be used for storing and answering questions
-            stored = store_document(document_id=pdf_file.name, text=pdf_text) #uses the function 'store_document' to embed and store the text
-        st.success(f"Stored {stored} paragraphs from {pdf_file.name}")
+            f.write(pdf_bytes)
+        #the PDF is streamed page by page into the database: extracting, embedding and inserting overlap
+        #the hash of the file lets an unchanged PDF skip all of it on reruns
+        if RAG_SERVICE_URL:
+            #each file is sent once (per content) and its job ID kept for this session,
+            #so reruns only ask the service how the job is doing instead of uploading again
+            jobs      = st.session_state.setdefault("ingest_jobs", {})
+            file_hash = content_hash(pdf_bytes)
+            if file_hash not in jobs:
+                jobs[file_hash] = service_submit(pdf_file.name, pdf_bytes)
+            job      = service_job(jobs[file_hash])
+            stored   = job["stored"] or 0
+            finished = job["status"] == "done"
+            if job["status"] == "failed":
+                st.error(f"Storing {pdf_file.name} failed: {job['error']}")
+                del jobs[file_hash] #uploading it again retries
+            elif job["status"] != "done":
+                st.info(f"{pdf_file.name} is being stored in the background ({job['status']}); "
+                        "you can already ask about the other documents")
+                st.button("Check again")
+        else:
+            with st.spinner("Extracting text and storing chunks and embeddings..."): #Shows status while storing data
+                stored = store_pdf(document_id=pdf_file.name, pdf_path=pdf_path, doc_hash=content_hash(pdf_bytes))
+            finished = True
+        if finished:
+            if stored:
+                st.success(f"Stored {stored} new paragraphs from {pdf_file.name}")
+            else:
+                st.info(f"{pdf_file.name} is already up to date, nothing new to store")
         st.subheader("Document Summary")
         doc = fitz.open(pdf_path)
         st.write(f"Pages: {len(doc)}")
-        st.write(f"Paragraphs stored: {stored}")
+        st.write(f"New paragraphs stored: {stored}")
         st.write("Preview (first 500 characters):")
-        st.text(pdf_text[:500]) #preview of the first 500 characters
+        preview = ""
+        for page in doc: #only reads as many pages as the preview needs
+            preview += page.get_text("text")
+            if len(preview) >= 500:
+                break
+        st.text(preview[:500]) #preview of the first 500 characters
         doc.close()
     # Instead of typing the question in the terminal, the user can type it in the browser and pick a number with a little widget
     question = st.text_input("Enter your question")
     top_n    = st.number_input("How many top-k chunks to retrieve?", min_value=1, max_value=10, value=5)
+    mode     = st.radio("Retrieval", ("vector", "hybrid"), index=("vector", "hybrid").index(RETRIEVAL_MODE), horizontal=True)
+
+    use_rerank = st.checkbox(f"Re-rank {RERANK_CANDIDATES} candidates with {RERANK_MODEL or 'a re-ranker (set RERANK_MODEL)'}",
+                             value=bool(RERANK_MODEL), disabled=not RERANK_MODEL)
+
+    # Optionally only search one document (defaults to the PDF that was just uploaded) and a page range
+    documents = ["All documents"] + (service_documents() if RAG_SERVICE_URL else list_documents())
+    default   = documents.index(pdf_file.name) if pdf_file and pdf_file.name in documents else 0
+    search_in = st.selectbox("Search in", documents, index=default)
+    col_from, col_to = st.columns(2)
+    page_from = col_from.number_input("From page (0 = first)", min_value=0, value=0)
+    page_to   = col_to.number_input("To page (0 = last)", min_value=0, value=0)
+    filters = {
+        "document_id": None if search_in == "All documents" else search_in,
+        "page_from": page_from or None,
+        "page_to": page_to or None,
+    }
 
     # Now you click a button to get the answer and the answer will be displayed in the browser
+    # The answer is written out as the tokens arrive instead of all at once at the end
     if st.button("Get Answer") and question:
-        with st.spinner("Thinking..."):
-            answer = answer_question(question, top_n=top_n)
         st.subheader("Answer")
-        st.write(answer)
+        timings = {}
+        sources = []
+        if RAG_SERVICE_URL:
+            st.write_stream(service_stream_answer(question, top_n, timings, mode, sources, filters, use_rerank))
+        else:
+            st.write_stream(stream_answer(question, top_n=top_n, timings=timings, mode=mode, sources=sources, filters=filters,
+                                          rerank_model=RERANK_MODEL if use_rerank else ""))
+        if sources:
+            #shows where each chunk ranked in each retriever (hybrid mode) or its distance (vector mode)
+            with st.expander("Retrieved chunks"):
+                for row in sources:
+                    meta = row[1]
+                    label = f"{row[4]}, page {meta['page']}" if "page" in meta else row[4]
+                    if len(row) > 5:
+                        st.markdown(f"**{label}**: fused score {row[2]:.4f}, vector rank {row[5] or '-'}, keyword rank {row[6] or '-'}")
+                    else:
+                        st.markdown(f"**{label}**: distance {row[2]:.4f}")
+                    st.text(row[0][:300])
+        if "total_seconds" in timings:
+            first_token = timings.get("first_token_seconds", timings["total_seconds"])
+            rerank_note = f", re-rank took {timings['rerank_seconds']:.2f}s" if "rerank_seconds" in timings else ""
+            st.caption(f"First token after {first_token:.2f}s, done after {timings['total_seconds']:.2f}s{rerank_note}")
+            #keeps the last 20 queries' timings so perceived latency can be tracked in the sidebar
+            history = st.session_state.setdefault("answer_timings", [])
+            history.append({"question": question, **{k: round(v, 3) for k, v in timings.items()}})
+            del history[:-20]
+
+    if RAG_SERVICE_URL:
+        #the caches and the pool live in the service process that answered
+        with st.sidebar.expander("Service"):
+            st.json(get_service_session().get(f"{RAG_SERVICE_URL}/stats", timeout=RAG_SERVICE_TIMEOUT).json())
+    else:
+        with st.sidebar.expander("Connection pool"):
+            st.json(pool_stats())
+        with st.sidebar.expander("Embedding cache"):
+            st.json(get_embedding_cache().summary())
+        with st.sidebar.expander("Answer cache"):
+            st.json(get_answer_cache().summary())
+    with st.sidebar.expander("Answer latency"):
+        st.dataframe(st.session_state.get("answer_timings", []))
 
+# python Basic_RAG_Pipeline3.py rebuild-index  -> rebuilds the ANN index after a bulk load
+# python Basic_RAG_Pipeline3.py index-report   -> recall vs latency of the index against exact search
+# python Basic_RAG_Pipeline3.py migrate-quantization [--keep-old] -> index existing rows for QUANTIZATION
+# python Basic_RAG_Pipeline3.py quantization-report -> memory / QPS / recall of each layout's index
+# python Basic_RAG_Pipeline3.py reembed        -> re-embeds stored rows (needed once for rows stored before /api/embed)
+# streamlit run Basic_RAG_Pipeline3.py         -> the web UI
 if __name__ == "__main__":
-    main()
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "rebuild-index":
+        rebuild_index()
+    elif command == "index-report":
+        index_recall_report()
+    elif command == "migrate-quantization":
+        migrate_quantization(keep_old="--keep-old" in sys.argv)
+    elif command == "quantization-report":
+        quantization_report()
+    elif command == "reembed":
+        reembed_chunks()
+    else:
+        main()
 
 
 
@@ -1,31 +1,315 @@
 import psycopg2  # lets Python connect to and talk with PostgreSQL
+from psycopg2.pool import ThreadedConnectionPool # keeps connections open between Streamlit reruns
+import psycopg2.errors # error classes like QueryCanceled (statement_timeout)
 import ollama    # lets you talk to an LLM installed on your computer
 from tabulate import tabulate #for nice table formatting
 import csv #for exporting results to CSV files
 import streamlit as st
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+import pandas as pd #for the results table with column names
+import numpy as np #for comparing the question with the table descriptions
 
+# The model that writes the SQL
+LLM_MODEL = os.getenv("SQL_MODEL", "llama3")
 
-# Open a connection to the PostgreSQL database
-conn = psycopg2.connect(
-    dbname="postgres",
-    user="postgres",
-    password="12345",
-    host="localhost",
-    port="5432"
-)
+# Generated SQL is cached on disk so the same question isn't translated again
+# on every Streamlit rerun (e.g. clicking an export option) or in a later session
+SQL_CACHE_PATH = os.getenv("SQL_CACHE_PATH", "sql_cache.sqlite3")
+SQL_CACHE_SIZE = int(os.getenv("SQL_CACHE_SIZE", "1000")) #entries kept, least recently used are dropped first
 
-cur = conn.cursor()  # Create a "cursor" to run queries
+# Results are read from a server-side cursor a batch at a time instead of all at once with fetchall()
+# the page shows RESULT_PAGE_SIZE rows at a time and never more than RESULT_ROW_CAP rows in total
+# (the query is wrapped in a LIMIT); exports read the full result FETCH_BATCH_SIZE rows at a time
+RESULT_PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "100"))
+RESULT_ROW_CAP   = int(os.getenv("RESULT_ROW_CAP", "10000"))
+FETCH_BATCH_SIZE = int(os.getenv("FETCH_BATCH_SIZE", "2000"))
 
-# Database schema description (for the LLM to understand structure)
-schema = """ 
-Tables:
-Customers(CustomerID, Name, Email)
-Orders(OrderID, CustomerID, ProductID, OrderDate)
-Products(ProductID, ProductName, Price)
-"""
+# Generated SQL runs in a READ ONLY transaction that PostgreSQL cancels after STATEMENT_TIMEOUT_MS
+# and before it runs, EXPLAIN estimates its cost: plans costing more than MAX_QUERY_COST are
+# rejected without touching the data (0 turns the check off)
+STATEMENT_TIMEOUT_MS = int(os.getenv("STATEMENT_TIMEOUT_MS", "15000"))
+MAX_QUERY_COST       = float(os.getenv("MAX_QUERY_COST", "1000000"))
+DB_POOL_MAX          = int(os.getenv("DB_POOL_MAX", "5"))
+DB_POOL_MIN          = int(os.getenv("DB_POOL_MIN", str(DB_POOL_MAX))) #the pool closes returned connections beyond min
+
+# The schema in the prompt is read from the database itself (pg_catalog) and refreshed every SCHEMA_REFRESH_SECONDS
+# only the SCHEMA_TOP_K tables whose description is most similar to the question (by embedding)
+# go into the prompt, plus the tables they reference, so the prompt stays small on big databases
+SCHEMA_SCHEMAS         = [n.strip() for n in os.getenv("SCHEMA_SCHEMAS", "public").split(",") if n.strip()]
+SCHEMA_REFRESH_SECONDS = int(os.getenv("SCHEMA_REFRESH_SECONDS", "600"))
+SCHEMA_TOP_K           = int(os.getenv("SCHEMA_TOP_K", "8"))
+SCHEMA_EMBED_MODEL     = os.getenv("SCHEMA_EMBED_MODEL", "nomic-embed-text")
+
+
+# Connection pool to the PostgreSQL database, created once per process
+# st.cache_resource keeps it alive across Streamlit reruns, so a rerun doesn't reconnect
+# every session is read-only by default, so even a transaction the query starts itself can't write,
+# and reads backslashes in plain '...' strings literally (has_multiple_statements relies on it)
+@st.cache_resource
+def get_db_pool():
+    return ThreadedConnectionPool(
+        DB_POOL_MIN,
+        DB_POOL_MAX,
+        dbname="postgres",
+        user="postgres",
+        password="12345",
+        host="localhost",
+        port="5432",
+        options="-c default_transaction_read_only=on -c standard_conforming_strings=on"
+    )
+
+# Raised when EXPLAIN says a query is too expensive to run
+class QueryRejected(Exception):
+    pass
+
+# Borrows a pooled connection and starts a READ ONLY transaction with a statement timeout on it
+# (SET LOCAL only lasts until the end of the transaction, so the pooled connection stays clean)
+# the transaction is always rolled back and the connection given back to the pool at the end
+@contextmanager
+def read_only_transaction(timeout_ms=STATEMENT_TIMEOUT_MS):
+    pool = get_db_pool()
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION READ ONLY;")
+            cur.execute("SET LOCAL statement_timeout = %s;", (timeout_ms,))
+        yield conn
+    finally:
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error: #the connection broke, drop it instead of pooling it
+                conn.close()
+        pool.putconn(conn, close=bool(conn.closed))
+
+# Finds a ; that ends a statement, i.e. one outside string literals, quoted names and comments
+# psycopg2 sends the query text as is, so "SELECT 1; COMMIT; DELETE ..." would run all three statements
+# a backslash only escapes inside E'...' strings: the pool turns standard_conforming_strings on,
+# so plain '...' strings always read backslashes literally, the same way this scanner does
+def has_multiple_statements(sql_query):
+    i, n = 0, len(sql_query)
+    while i < n:
+        ch = sql_query[i]
+        if ch in ("'", '"'): #string literal or quoted name, a doubled quote is an escaped quote
+            #E'...' (the E not being the end of a longer name) also takes backslash escapes, e.g. E'\''
+            escapes = (ch == "'" and i > 0 and sql_query[i - 1] in "eE"
+                       and (i < 2 or not (sql_query[i - 2].isalnum() or sql_query[i - 2] in "_$")))
+            i += 1
+            while i < n:
+                if escapes and sql_query[i] == "\\":
+                    i += 2
+                    continue
+                if sql_query[i] == ch:
+                    if i + 1 < n and sql_query[i + 1] == ch:
+                        i += 2
+                        continue
+                    break
+                i += 1
+        elif sql_query.startswith("--", i):
+            end = sql_query.find("\n", i)
+            i = n if end < 0 else end
+        elif sql_query.startswith("/*", i):
+            end = sql_query.find("*/", i + 2)
+            i = n if end < 0 else end + 1
+        elif ch == "$": #dollar-quoted string: $$...$$ or $tag$...$tag$
+            match = re.match(r"\$(?:[A-Za-z_]\w*)?\$", sql_query[i:])
+            if match:
+                end = sql_query.find(match.group(0), i + len(match.group(0)))
+                i = n if end < 0 else end + len(match.group(0)) - 1
+        elif ch == ";":
+            return True
+        i += 1
+    return False
+
+# Asks the planner what the query would cost without running it
+# returns the top plan node (with "Total Cost" and "Plan Rows"); raises QueryRejected over max_cost
+# or when the text is more than one statement (checked first, so nothing of it runs)
+def check_cost(conn, sql_query, max_cost=MAX_QUERY_COST):
+    if has_multiple_statements(sql_query):
+        raise QueryRejected("the generated SQL has more than one statement; only a single SELECT is run")
+    with conn.cursor() as cur:
+        cur.execute("EXPLAIN (FORMAT JSON) " + sql_query)
+        plan = cur.fetchone()[0][0]["Plan"]
+    if max_cost and plan["Total Cost"] > max_cost:
+        raise QueryRejected(f"estimated cost {plan['Total Cost']:.0f} is over the limit of {max_cost:.0f} "
+                            f"(about {plan['Plan Rows']} rows); try a narrower question")
+    return plan
+
+# Database schema catalog (for the LLM to understand structure)
+# reads every table and view in SCHEMA_SCHEMAS with its columns, types, comments and foreign keys
+# st.cache_data keeps the result for SCHEMA_REFRESH_SECONDS, so new tables show up without a restart
+# returns a list of {"name", "description", "references"} where description is what goes into the prompt, e.g.
+#   Orders(OrderID integer, CustomerID integer, OrderDate date) -- one row per order
+#     FOREIGN KEY (CustomerID) REFERENCES Customers(CustomerID)
+@st.cache_data(ttl=SCHEMA_REFRESH_SECONDS, show_spinner="Reading the database schema...")
+def load_catalog(schemas=tuple(SCHEMA_SCHEMAS)):
+    with read_only_transaction() as conn, conn.cursor() as cur:
+        cur.execute("""
+          SELECT c.oid::regclass::text, obj_description(c.oid, 'pg_class'),
+                 quote_ident(a.attname), format_type(a.atttypid, a.atttypmod), col_description(c.oid, a.attnum)
+          FROM pg_class AS c
+          JOIN pg_namespace AS n ON n.oid = c.relnamespace
+          JOIN pg_attribute AS a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+          WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f') AND n.nspname = ANY(%s)
+          ORDER BY 1, a.attnum;
+        """, (list(schemas),))
+        columns = cur.fetchall()
+        cur.execute("""
+          SELECT conrelid::regclass::text, confrelid::regclass::text, pg_get_constraintdef(oid)
+          FROM pg_constraint
+          WHERE contype = 'f' AND connamespace IN (SELECT oid FROM pg_namespace WHERE nspname = ANY(%s));
+        """, (list(schemas),))
+        foreign_keys = cur.fetchall()
+
+    tables = {}
+    for name, table_comment, column, data_type, column_comment in columns:
+        table = tables.setdefault(name, {"comment": table_comment, "columns": [], "foreign_keys": [], "references": []})
+        table["columns"].append(f"{column} {data_type}" + (f" /* {column_comment} */" if column_comment else ""))
+    for name, referenced, definition in foreign_keys:
+        if name in tables:
+            tables[name]["foreign_keys"].append(definition)
+            tables[name]["references"].append(referenced)
+
+    catalog = []
+    for name, table in tables.items():
+        description = f"{name}({', '.join(table['columns'])})"
+        if table["comment"]:
+            description += f" -- {table['comment']}"
+        for definition in table["foreign_keys"]:
+            description += f"\n  {definition}"
+        catalog.append({"name": name, "description": description, "references": table["references"]})
+    return catalog
+
+# Fingerprint of the whole catalog and the table-picking settings
+# the SQL cache is keyed on it, so any schema change invalidates the cached SQL
+def catalog_version(catalog):
+    text = "\n".join(t["description"] for t in catalog)
+    return schema_hash(f"{text}\n{SCHEMA_EMBED_MODEL}:{SCHEMA_TOP_K}")
+
+# Table description embeddings, kept across reruns and refreshes
+# keyed by the description text, so after a refresh only new or changed tables are embedded again
+@st.cache_resource
+def get_table_embeddings():
+    return {}
+
+def embed_texts(texts, batch_size=64):
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        vectors.extend(ollama.embed(model=SCHEMA_EMBED_MODEL, input=texts[start:start + batch_size])["embeddings"])
+    matrix = np.array(vectors, dtype=np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True).clip(min=1e-12)
+
+# Picks the tables the question is most likely about: the top_k most similar table descriptions,
+# plus the tables those reference through foreign keys (so joins have both sides)
+# small databases (top_k tables or fewer) are sent whole
+def relevant_tables(question, catalog, top_k=SCHEMA_TOP_K):
+    if len(catalog) <= top_k:
+        return catalog
+    store   = get_table_embeddings()
+    missing = [t["description"] for t in catalog if t["description"] not in store]
+    try:
+        if missing:
+            store.update(zip(missing, embed_texts(missing)))
+        scores = np.stack([store[t["description"]] for t in catalog]) @ embed_texts([question])[0]
+    except Exception as e: #no embedding model: better a big prompt than no answer
+        print(f"Could not rank tables by similarity, using all {len(catalog)}: {e}")
+        return catalog
+    chosen = {catalog[i]["name"] for i in np.argsort(-scores)[:top_k]}
+    chosen |= {ref for t in catalog if t["name"] in chosen for ref in t["references"]}
+    return [t for t in catalog if t["name"] in chosen]
+
+# Questions that only differ in case, spacing or trailing punctuation share a cache entry
+# text in quotes is kept as typed: 'McDonald' and 'mcdonald' are different values in the SQL
+def normalize_question(question):
+    question = re.sub(r"\s+", " ", question).strip().rstrip("?.!").strip()
+    parts    = re.split(r"""('[^']*'|"[^"]*")""", question) #odd indexes are the quoted spans
+    return "".join(part if i % 2 else part.lower() for i, part in enumerate(parts))
+
+# Fingerprint of a schema description, so SQL written for an older schema is never reused
+def schema_hash(schema_text):
+    return hashlib.sha256(schema_text.encode("utf-8")).hexdigest()
+
+# SQLite-backed cache of generated SQL
+# key = normalized question + model + schema hash
+# when the schema description changes, entries made for any other schema are deleted
+# when there are more than max_size entries, the least recently used ones are deleted
+class SQLCache:
+    def __init__(self, path, max_size, current_schema_hash):
+        self.max_size = max_size
+        self.lock     = threading.Lock()
+        self.db       = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+          CREATE TABLE IF NOT EXISTS sql_cache (
+            question    TEXT NOT NULL,
+            model       TEXT NOT NULL,
+            schema_hash TEXT NOT NULL,
+            sql         TEXT NOT NULL,
+            last_used   REAL NOT NULL,
+            PRIMARY KEY (question, model, schema_hash)
+          );
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS sql_cache_last_used ON sql_cache (last_used);")
+        stale = self.db.execute("DELETE FROM sql_cache WHERE schema_hash != ?;", (current_schema_hash,)).rowcount
+        self.db.commit()
+        self.stats = {"hits": 0, "misses": 0, "stale_dropped": stale, "evictions": 0}
+
+    #returns the cached SQL, or None
+    def get(self, question, model, schema_hash):
+        key = (normalize_question(question), model, schema_hash)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT sql FROM sql_cache WHERE question = ? AND model = ? AND schema_hash = ?;", key).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self.db.execute("UPDATE sql_cache SET last_used = ? WHERE question = ? AND model = ? AND schema_hash = ?;",
+                            (time.time(),) + key)
+            self.db.commit()
+            self.stats["hits"] += 1
+            return row[0]
+
+    def put(self, question, model, schema_hash, sql):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO sql_cache VALUES (?, ?, ?, ?, ?);",
+                            (normalize_question(question), model, schema_hash, sql, time.time()))
+            over = self.db.execute("SELECT count(*) FROM sql_cache;").fetchone()[0] - self.max_size
+            if over > 0:
+                self.db.execute("""
+                  DELETE FROM sql_cache WHERE rowid IN (
+                    SELECT rowid FROM sql_cache ORDER BY last_used LIMIT ?
+                  );
+                """, (over,))
+                self.stats["evictions"] += over
+            self.db.commit()
+
+# One cache per process, kept alive across Streamlit reruns
+@st.cache_resource
+def get_sql_cache(current_schema_hash):
+    return SQLCache(SQL_CACHE_PATH, SQL_CACHE_SIZE, current_schema_hash)
 
 # Function: convert a natural language question into an SQL query
-def nl_to_sql(question):
+# The answer comes from the SQL cache when this question was already translated for this model and schema
+# Only the tables relevant to the question are described in the prompt (see relevant_tables)
+# tables (a list, optional) gets the names of the tables that were put in the prompt
+# use_cache=False always asks the model (the new SQL still replaces the cached one)
+def nl_to_sql(question, model=LLM_MODEL, tables: list = None, use_cache: bool = True):
+    catalog      = load_catalog()
+    current_hash = catalog_version(catalog)
+    cache  = get_sql_cache(current_hash)
+    cached = cache.get(question, model, current_hash) if use_cache else None
+    if cached is not None:
+        return cached
+    chosen = relevant_tables(question, catalog)
+    if tables is not None:
+        tables.extend(t["name"] for t in chosen)
+    schema = "Tables:\n" + "\n".join(t["description"] for t in chosen)
     prompt = f"""
     You are a data assistant. Convert the following natural language question into a valid PostgreSQL query. Return ONLY the SQL code. Do not include explanations or anything else. Only use SELECT statements, do not delete or update data.
     {schema}
@@ -35,52 +319,135 @@ def nl_to_sql(question):
     """
     try:
         # Send the prompt to the LLM
-        response = ollama.chat(model="llama3", messages=[{"role": "user", "content": prompt}])
-        return response["message"]["content"].strip()
+        response = ollama.chat(model=model, messages=[{"role": "user", "content": prompt}])
+        sql_query = response["message"]["content"].strip()
+        if sql_query: #failed or empty answers are not cached, so they are retried next time
+            cache.put(question, model, current_hash, sql_query)
+        return sql_query
     except Exception as e: #If Ollama fails or something else goes wrong, the function prints an error and returns None
         print("Error while generating SQL:", e)
         return None
 
+# The model sometimes wraps the SQL in ``` fences or ends it with a semicolon
+# both are removed so the query can be used as a subquery
+def clean_sql(sql_query):
+    sql_query = re.sub(r"^```(?:sql)?\s*|\s*```$", "", sql_query.strip(), flags=re.IGNORECASE)
+    return sql_query.strip().rstrip(";").strip()
+
+# Caps how many rows a query can return by wrapping it: SELECT * FROM (query) LIMIT n
+def limit_sql(sql_query, limit):
+    return f"SELECT * FROM (\n{sql_query}\n) AS llm_query LIMIT {int(limit)}"
+
+# Runs the query on a named (server-side) cursor: PostgreSQL keeps the result and sends
+# batch_size rows per fetchmany, so only one batch is ever in memory here
+# it runs read-only with a timeout, after the EXPLAIN cost check (see read_only_transaction, check_cost)
+# skip moves the cursor forward first (used for paging)
+# yields (column_names, rows) for each batch; an empty result still yields its column names once, with no rows
+def iter_batches(sql_query, batch_size=FETCH_BATCH_SIZE, skip=0, timeout_ms=STATEMENT_TIMEOUT_MS):
+    with read_only_transaction(timeout_ms) as conn:
+        check_cost(conn, sql_query)
+        with conn.cursor(name=f"llm_query_{uuid.uuid4().hex}") as cur: #named cursor = server-side cursor
+            cur.execute(sql_query)
+            if skip:
+                cur.scroll(skip)
+            yielded = False
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if rows or not yielded:
+                    yield [desc[0] for desc in cur.description], rows
+                    yielded = True
+                if not rows:
+                    break
+
+# Gets one page of results (page 0 is the first), capped at row_cap rows overall
+# returns (column_names, rows, whether there is a next page)
+def fetch_page(sql_query, page, page_size=RESULT_PAGE_SIZE, row_cap=RESULT_ROW_CAP):
+    start = page * page_size
+    if start >= row_cap:
+        return [], [], False
+    #one extra row tells whether there is another page
+    batches = iter_batches(limit_sql(sql_query, row_cap), page_size + 1, skip=start)
+    try:
+        for column_names, rows in batches:
+            return column_names, rows[:page_size], len(rows) > page_size
+        return [], [], False
+    finally:
+        batches.close() #gives the connection back to the pool right away
+
+# Writes the full result to a CSV file one batch at a time; returns the number of rows written
+def export_csv(sql_query, path):
+    count = 0
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        for batch_number, (column_names, rows) in enumerate(iter_batches(sql_query)):
+            if batch_number == 0:
+                writer.writerow(column_names) #write headers (also when there are no rows)
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+# Writes the full result as grid tables, one block per batch (each with its own header),
+# so the file is never built in memory; returns the number of rows written
+def export_table(sql_query, path):
+    count = 0
+    with open(path, "w") as f:
+        for column_names, rows in iter_batches(sql_query):
+            f.write(tabulate(rows, headers=column_names, tablefmt="grid") + "\n")
+            count += len(rows)
+    return count
+
 #Streamlit Part-------------------------------------------------------------------------------------------------------------
-#Title of the app
-st.title("Natural Language to SQL with Ollama and PostgreSQL")
-#Creates a box where the user can type a natural language question
-#whatever they type gets stored in the variable 'question'
-question = st.text_input("Enter your question in plain English:")
-
-if question: #only run question if the user typed something
-    sql_query = nl_to_sql(question) #stores the SQL query generated by the LLM in 'sql_query'
-    if sql_query: #if sql_query contains a non-empty string
-        st.subheader("Generated SQL:") #section title
-        st.code(sql_query, language="sql") #displays the SQL query in a code block with SQL syntax highlighting
-
-        try:
-            cur.execute(sql_query) #sends SQL to PostgreSQL
-            results = cur.fetchall() #get results
-            column_names = [desc[0] for desc in cur.description] #gets the column names
-            st.subheader("Query Results:") #section title
-            st.dataframe(results) #displays the results in a table format
-            
-            choice = st.radio("Do you want to export the results?", ("none", "csv", "table")) #radio buttons with the 3 options for exporting the results
-            if choice == "csv": #if the user selects "csv"
-                with open("query_results.csv", "w", newline="") as f: #opens or creates a new file called 'query_results.csv' and saves it as the variable f
-                    writer = csv.writer(f) #creates a csv writer object- it will write to the file f
-                    writer.writerow(column_names) #write headers
-                    writer.writerows(results) #write the data
-                st.success("Results saved to query_results.csv") #shows a success message in streamlit
-            elif choice == "table": #if the user selects 'table'
-                with open("query_results.txt", "w") as f: #opens or creates a new file called 'query_results.txt' and saves it as the variable f
-                    f.write(tabulate(results, headers=column_names, tablefmt="grid")) #writes the results in a grid format table to the file
-                st.success("Results saved to query_results.txt") #shows a success message in streamlit
-            else: #if the user selects 'none'
-                st.info("No export selected.") #no export selected message
-        except psycopg2.Error as db_error: #If PostgreSQL returns an error, it is caught here and printed
-            st.error(f"Database error: {db_error}")
-        except Exception as e: #Catches any other unexpected error
-            st.error(f"Unexpected error: {e}")
-
-
-
-# Clean up database connection
-cur.close() #closes the cursor
-conn.close() #closes the connection to PostgreSQL
+# The whole page is built in main(), so other scripts (like nl_to_sql_batch.py) can import
+# nl_to_sql and the execution helpers without drawing the page
+def main():
+    #Title of the app
+    st.title("Natural Language to SQL with Ollama and PostgreSQL")
+    #Creates a box where the user can type a natural language question
+    #whatever they type gets stored in the variable 'question'
+    question = st.text_input("Enter your question in plain English:")
+
+    if question: #only run question if the user typed something
+        prompt_tables = []
+        sql_query = nl_to_sql(question, tables=prompt_tables) #stores the SQL query generated by the LLM in 'sql_query'
+        if sql_query: #if sql_query contains a non-empty string
+            st.subheader("Generated SQL:") #section title
+            st.code(sql_query, language="sql") #displays the SQL query in a code block with SQL syntax highlighting
+            if prompt_tables: #empty when the SQL came from the cache
+                st.caption("Tables given to the model: " + ", ".join(prompt_tables))
+
+            try:
+                query = clean_sql(sql_query)
+                page  = st.number_input("Page", min_value=1, value=1) - 1 #which page of results to show
+                column_names, rows, more = fetch_page(query, page) #only this page is fetched from PostgreSQL
+                st.subheader("Query Results:") #section title
+                st.dataframe(pd.DataFrame(rows, columns=column_names)) #displays the results in a table format
+                first = page * RESULT_PAGE_SIZE
+                if rows:
+                    st.caption(f"Rows {first + 1}-{first + len(rows)}" + ("" if more else " (last page)"))
+                if first + len(rows) >= RESULT_ROW_CAP:
+                    st.warning(f"At most {RESULT_ROW_CAP} rows are shown here, export to get all of them.")
+
+                choice = st.radio("Export format", ("csv", "table")) #radio buttons with the 2 export formats
+                #the export reads every row, so it only runs on the rerun the button was clicked in
+                #(a radio value persists, and would re-export on every page change)
+                if st.button("Export all rows"):
+                    if choice == "csv": #if the user selects "csv"
+                        count = export_csv(query, "query_results.csv") #streams all rows into query_results.csv
+                        st.success(f"{count} rows saved to query_results.csv") #shows a success message in streamlit
+                    else: #if the user selects 'table'
+                        count = export_table(query, "query_results.txt") #streams all rows into query_results.txt as grid tables
+                        st.success(f"{count} rows saved to query_results.txt") #shows a success message in streamlit
+            except QueryRejected as rejected: #EXPLAIN estimated the query as too expensive, so it never ran
+                st.error(f"Query not run: {rejected}")
+            except psycopg2.errors.QueryCanceled: #statement_timeout stopped it
+                st.error(f"The query took longer than {STATEMENT_TIMEOUT_MS / 1000:g} seconds and was stopped.")
+            except psycopg2.errors.ReadOnlySqlTransaction: #the model wrote something that changes data
+                st.error("The generated SQL tries to change data; only SELECT queries are run.")
+            except psycopg2.Error as db_error: #If PostgreSQL returns an error, it is caught here and printed
+                st.error(f"Database error: {db_error}")
+            except Exception as e: #Catches any other unexpected error
+                st.error(f"Unexpected error: {e}")
+
+# streamlit run LLMtoSQL3.py
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
-import subprocess
 import logging
-import re
+import os
+import httpx
+import ollama
 import streamlit 
 
 # Setup logging to both file and console
@@ -13,78 +14,113 @@ logging.basicConfig(
     ]
 )
 
-# Regex to remove ANSI escape codes
-ansi_escape = re.compile(r'\x1B[@-_][0-?]*[ -/]*[@-~]')
-
-
-
-def ask_ollama(prompt, model="llama3"):
+# Where the Ollama server listens, and how long it keeps a model loaded after the last request
+# (keep_alive pins the model in memory so the next message doesn't wait for it to load again)
+OLLAMA_HOST       = os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# How long the model list is reused before asking the server again (seconds)
+MODELS_TTL        = int(os.getenv("OLLAMA_MODELS_TTL", "30"))
+
+
+# One HTTP client for the whole process, kept across Streamlit reruns
+# it keeps its connection to the server open, so a message doesn't pay for a new process or connection
+@streamlit.cache_resource
+def get_ollama_client():
+    return ollama.Client(host=OLLAMA_HOST)
+
+# Sends the prompt to the Ollama API and yields the response piece by piece as it is generated
+# errors are yielded as text, with the same messages the UI has always shown
+def stream_ollama(prompt, model="llama3"):
+    logging.info(f"Running ollama with model '{model}' and prompt: {prompt}")
+    parts = []
     try:
-        logging.info(f"Running ollama with model '{model}' and prompt: {prompt}")
-        result = subprocess.run(
-            ["ollama", "run", model, prompt],
-            capture_output=True,
-            text=True
-        )
-        if result.returncode == 0:
-            response = result.stdout.strip()
-            logging.info(f"Response: {response}")
-            return response
-        else:
-            error_msg = result.stderr.strip()
-            logging.error(f"Ollama error: {error_msg}")
-            return f"Error running Ollama:\n{error_msg}"
-    except FileNotFoundError:
-        return "Ollama is not installed or not in PATH."
-    except subprocess.CalledProcessError as e:
-        return f"A system error occurred:\n{e}"
-        
+        for part in get_ollama_client().generate(model=model, prompt=prompt, stream=True, keep_alive=OLLAMA_KEEP_ALIVE):
+            parts.append(part["response"])
+            yield part["response"]
+    except ollama.ResponseError as e: #the server answered with an error, e.g. unknown model
+        logging.error(f"Ollama error: {e.error}")
+        yield f"Error running Ollama:\n{e.error}"
+        return
+    except (ConnectionError, httpx.ConnectError): #nothing is listening at OLLAMA_HOST
+        logging.error(f"Could not connect to Ollama at {OLLAMA_HOST}")
+        yield f"Ollama is not installed or not running (could not connect to {OLLAMA_HOST})."
+        return
+    except httpx.HTTPError as e:
+        logging.error(f"HTTP error talking to Ollama: {e}")
+        yield f"A system error occurred:\n{e}"
+        return
+    logging.info(f"Response: {''.join(parts).strip()}")
+
+# Returns the whole response as one string (same as stream_ollama, without the streaming)
+def ask_ollama(prompt, model="llama3"):
+    return "".join(stream_ollama(prompt, model=model)).strip()
+
+
+# Asks the Ollama API which models are installed (/api/tags) and which are loaded in memory (/api/ps)
+# st.cache_data reuses the answer for MODELS_TTL seconds, so reruns (every keystroke) don't ask again
+# returns one dict per model: name, size_gb, family, parameters, quantization, loaded
+# errors are raised (and not cached), list_ollama_models reports them
+@streamlit.cache_data(ttl=MODELS_TTL, show_spinner=False)
+def fetch_models():
+    client = get_ollama_client()
+    loaded = {m.get("model") or m.get("name") for m in client.ps()["models"]}
+    models = []
+    for m in client.list()["models"]:
+        name    = m.get("model") or m.get("name") #older ollama versions call it "name"
+        details = m.get("details") or {}
+        models.append({
+            "name": name,
+            "size_gb": round((m.get("size") or 0) / 1e9, 2),
+            "family": details.get("family"),
+            "parameters": details.get("parameter_size"),
+            "quantization": details.get("quantization_level"),
+            "loaded": name in loaded,
+        })
+    #models that are already in memory first, they answer without a load
+    return sorted(models, key=lambda m: (not m["loaded"], m["name"]))
+
 def list_ollama_models():
     try:
-        result = subprocess.run(
-            ["ollama", "list"],
-            capture_output=True,
-            text=True
-        )
-        if result.returncode == 0:
-            output = result.stdout.strip()
-            print("Available Ollama models:\n" + output + "\n")
-
-            lines = [ansi_escape.sub('', line) for line in output.splitlines()]
-            models = [line.strip().split()[0].lower() for line in lines[1:] if line.strip()]
-            print("DEBUG: Cleaned model names:", models)
-            return models
-        else:
-            streamlit.error("Error listing models:\n" + result.stderr.strip())
-            return []
-    except FileNotFoundError:
-        streamlit.error("Ollama is not installed or not in PATH.")
+        return fetch_models()
+    except ollama.ResponseError as e:
+        streamlit.error("Error listing models:\n" + e.error)
+        return []
+    except (ConnectionError, httpx.ConnectError):
+        streamlit.error(f"Ollama is not installed or not running (could not connect to {OLLAMA_HOST}).")
         return []
-
-
-
 
 #Streamlit UI
-streamlit.title("Ollama Chatbot with CLI interface")
-
-models = list_ollama_models()
-if not models:
-    models = ["llama3"] #fallback if listing fails
-
-user_input = streamlit.text_area("Type your message here:", height=100)
-model = streamlit.selectbox("Choose a model:", models)
-
-if "response" not in streamlit.session_state:
-    streamlit.session_state.response = ""
-
-if streamlit.button("Ask"):
-    if user_input.strip():
-        with streamlit.spinner("Thinking..."):
-            streamlit.session_state.response = ask_ollama(user_input, model=model)
-    else:
+def main():
+    streamlit.title("Ollama Chatbot with CLI interface")
+
+    models = list_ollama_models()
+    names  = [m["name"] for m in models] or ["llama3"] #fallback if listing fails
+    warm   = {m["name"] for m in models if m["loaded"]}
+
+    user_input = streamlit.text_area("Type your message here:", height=100)
+    model = streamlit.selectbox("Choose a model:", names,
+                                format_func=lambda name: f"{name} (loaded)" if name in warm else name)
+    if models:
+        with streamlit.expander("Installed models"):
+            streamlit.dataframe(models)
+
+    if "response" not in streamlit.session_state:
+        streamlit.session_state.response = ""
+
+    if streamlit.button("Ask"):
+        if user_input.strip():
+            #the response is written out as it is generated, then kept for the next reruns
+            streamlit.markdown("Response")
+            streamlit.session_state.response = streamlit.write_stream(stream_ollama(user_input, model=model))
+            fetch_models.clear() #the model is loaded now, so the list should say so
+            return
         streamlit.warning("Please type a prompt before clicking Ask.")
 
-if streamlit.session_state.response:
-    streamlit.markdown("Response")
-    streamlit.write(streamlit.session_state.response)
+    if streamlit.session_state.response:
+        streamlit.markdown("Response")
+        streamlit.write(streamlit.session_state.response)
+
+# streamlit run PromptBasedCLI2.py
+if __name__ == "__main__":
+    main()
 
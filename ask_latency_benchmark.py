@@ -0,0 +1,68 @@
+#Compares the two ways PromptBasedCLI2 can talk to Ollama, against the mock server (mock_ollama.py)
+#1. subprocess: `ollama run <model> <prompt>` for every message (how ask_ollama used to work)
+#   needs the ollama CLI on PATH; it is pointed at the mock with OLLAMA_HOST
+#2. http: ask_ollama / stream_ollama, one persistent keep-alive client to the API
+#For each it reports p50 / p95 of the full response time, and for http also the time to the first token
+#The mock's delays (--first-token-delay, --token-delay) are the same for both, so the difference is the overhead
+#usage: python ask_latency_benchmark.py [--requests 50] [--token-delay 0.005]
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import time
+from mock_ollama import start_mock_server
+from latency_stats import percentile
+
+PROMPT = "Explain in one sentence what a connection pool is."
+
+
+#the old path: a new ollama CLI process per message
+def ask_subprocess(prompt, model):
+    result = subprocess.run(["ollama", "run", model, prompt], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip())
+    return result.stdout.strip()
+
+def report(name, seconds):
+    print(f"  {name:<22} p50 {percentile(seconds, 50) * 1000:8.1f} ms   p95 {percentile(seconds, 95) * 1000:8.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency of ollama run (subprocess) vs the persistent HTTP client")
+    parser.add_argument("--requests", type=int, default=50, help="messages sent with each method")
+    parser.add_argument("--model", default="llama3:latest")
+    parser.add_argument("--first-token-delay", type=float, default=0.0, help="mock seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="mock seconds per generated token")
+    args = parser.parse_args()
+
+    server = start_mock_server(first_token_delay=args.first_token_delay, token_delay=args.token_delay, models=(args.model,))
+    os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{server.server_address[1]}" #read by both the CLI and the client
+    import PromptBasedCLI2 as cli
+    logging.getLogger().setLevel(logging.WARNING) #the chat log would print every prompt and response
+    print(f"{args.requests} requests per method against the mock at {os.environ['OLLAMA_HOST']}")
+
+    if shutil.which("ollama"):
+        seconds = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            ask_subprocess(PROMPT, args.model)
+            seconds.append(time.perf_counter() - start)
+        report("subprocess total", seconds)
+    else:
+        print("  subprocess: skipped, the ollama CLI is not on PATH")
+
+    total, first = [], []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        stream = cli.stream_ollama(PROMPT, model=args.model)
+        next(stream)
+        first.append(time.perf_counter() - start)
+        for _ in stream:
+            pass
+        total.append(time.perf_counter() - start)
+    report("http first token", first)
+    report("http total", total)
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#Compares the chunkers in Basic_RAG_Pipeline3 on sample PDFs
+#For every PDF and every chunker it reports:
+#1. how many chunks come out, and their average / largest size in tokens
+#2. how long it takes to embed all of them (the embedding cache is skipped so the timing is real)
+#3. retrieval hit rate: random sentences from the PDF are used as questions, and a question is a hit
+#   if one of the top-k most similar chunks contains that sentence
+#Nothing is written to the database, the similarity search is done in memory
+#usage: python chunk_benchmark.py file1.pdf file2.pdf ... [--questions 50] [--top-k 5]
+import argparse
+import random
+import time
+import numpy as np
+import ollama
+import Basic_RAG_Pipeline3 as rag
+
+
+#embeds texts in batches straight through ollama (no cache) and returns a normalized matrix
+def embed_all(texts, batch_size=rag.EMBED_BATCH_SIZE):
+    if not texts:
+        return np.zeros((0, rag.TABLE_DIM), dtype=np.float32)
+    vectors = []
+    for batch in rag.batched(texts, batch_size):
+        vectors.extend(ollama.embed(model=rag.EMBED_MODEL, input=batch)["embeddings"])
+    matrix = np.array(vectors, dtype=np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True).clip(min=1e-12)
+
+#picks sample questions: sentences with at least 8 words, same ones for every chunker
+def sample_questions(paragraphs, count, seed=0):
+    sentences = [s for para, _ in paragraphs for s in rag.split_sentences(para) if len(s.split()) >= 8]
+    random.Random(seed).shuffle(sentences)
+    return sentences[:count]
+
+def benchmark_pdf(pdf_path, questions_count, top_k):
+    paragraphs = list(rag.iter_paragraphs(rag.iter_pdf_pages(pdf_path)))
+    questions  = sample_questions(paragraphs, questions_count)
+    q_matrix   = embed_all(questions) if questions else None
+    results    = []
+    for name, chunker in rag.CHUNKERS.items():
+        chunks = [text for text, _ in chunker(iter(paragraphs))]
+        tokens = [rag.count_tokens(c) for c in chunks]
+        start  = time.perf_counter()
+        c_matrix = embed_all(chunks)
+        embed_seconds = time.perf_counter() - start
+
+        hits = 0
+        if questions:
+            #chunk text is whitespace-normalized, so compare normalized sentences
+            flat_chunks = [" ".join(c.split()) for c in chunks]
+            scores = q_matrix @ c_matrix.T
+            for question, row in zip(questions, scores):
+                top = np.argsort(-row)[:top_k]
+                if any(question in flat_chunks[i] for i in top):
+                    hits += 1
+        results.append({
+            "chunker": name,
+            "chunks": len(chunks),
+            "avg_tokens": round(sum(tokens) / len(tokens), 1) if tokens else 0,
+            "max_tokens": max(tokens, default=0),
+            "embed_seconds": round(embed_seconds, 2),
+            "hit_rate": round(hits / len(questions), 3) if questions else None,
+        })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare chunkers on sample PDFs")
+    parser.add_argument("pdfs", nargs="+", help="PDF files to benchmark on")
+    parser.add_argument("--questions", type=int, default=50, help="sample questions per PDF")
+    parser.add_argument("--top-k", type=int, default=5, help="chunks retrieved per question")
+    args = parser.parse_args()
+
+    print(f"token chunker: target {rag.CHUNK_TOKENS}, overlap {rag.CHUNK_OVERLAP_TOKENS}, min {rag.CHUNK_MIN_TOKENS}")
+    for pdf_path in args.pdfs:
+        print(f"\n{pdf_path}")
+        print(f"  {'chunker':<10} {'chunks':>7} {'avg tok':>8} {'max tok':>8} {'embed s':>8} {'hit@' + str(args.top_k):>7}")
+        for r in benchmark_pdf(pdf_path, args.questions, args.top_k):
+            print(f"  {r['chunker']:<10} {r['chunks']:>7} {r['avg_tokens']:>8} {r['max_tokens']:>8} "
+                  f"{r['embed_seconds']:>8} {str(r['hit_rate']):>7}")
+
+if __name__ == "__main__":
+    main()
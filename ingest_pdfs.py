@@ -0,0 +1,153 @@
+#Headless bulk ingestion for Basic_RAG_Pipeline3: stores every PDF under one or more directories
+#without going through the Streamlit uploader (and without writing temp_ files)
+#1. walks the directory trees and finds the PDFs
+#2. skips the files the checkpoint file says were already stored with the same content
+#3. ingests the rest with a pool of worker processes, one PDF per task (store_pdf: extract -> chunk -> embed -> insert)
+#4. appends each finished file to the checkpoint, so an interrupted run picks up where it stopped
+#5. prints per-file and overall throughput for each stage (pages/s, chunks/s, rows/s)
+#usage: python ingest_pdfs.py docs/ more_docs/ [--workers 4] [--checkpoint ingest_checkpoint.jsonl]
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import Basic_RAG_Pipeline3 as rag
+
+STAT_KEYS = ("pages", "chunks", "rows", "extract_seconds", "chunk_seconds", "embed_seconds", "insert_seconds")
+
+
+#finds all PDFs under the given directories (or single files), in a stable order
+def find_pdfs(paths):
+    found = []
+    for path in paths:
+        if os.path.isfile(path):
+            found.append((path, os.path.dirname(path)))
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(".pdf"):
+                    found.append((os.path.join(root, name), path))
+    return found
+
+#sha256 of a file, read in blocks so big PDFs aren't loaded at once
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+#reads the checkpoint file: the set of (path, hash) pairs that are already stored
+def load_checkpoint(checkpoint_path):
+    done = set()
+    if not os.path.exists(checkpoint_path):
+        return done
+    with open(checkpoint_path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entry = json.loads(line)
+                done.add((entry["path"], entry["hash"]))
+    return done
+
+#runs once in each worker process, before its first task
+#a worker stores one PDF at a time over a single connection, so its pool stays small: with the
+#default pool size, cpu_count workers would open more connections than Postgres allows
+def init_worker(pool_size):
+    rag.DB_POOL_MIN = 1
+    rag.DB_POOL_MAX = pool_size
+
+#runs in a worker process: stores one PDF and returns its stats
+#extraction stays inside the worker (pdf_workers=1) since the files themselves are already spread over processes
+def ingest_one(pdf_path, document_id, doc_hash):
+    stats = {}
+    start = time.perf_counter()
+    stored = rag.store_pdf(document_id, pdf_path, doc_hash=doc_hash, stats=stats, pdf_workers=1)
+    return stored, stats, time.perf_counter() - start
+
+def rate(count, seconds):
+    return count / seconds if seconds > 0 else 0.0
+
+def print_file_line(pdf_path, stored, stats, elapsed):
+    print(f"{pdf_path}: {stats.get('pages', 0)} pages, {stats.get('chunks', 0)} chunks, {stored} new rows "
+          f"in {elapsed:.1f}s (extract {stats.get('extract_seconds', 0):.1f}s, chunk {stats.get('chunk_seconds', 0):.1f}s, "
+          f"embed {stats.get('embed_seconds', 0):.1f}s, insert {stats.get('insert_seconds', 0):.1f}s)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-ingest directories of PDFs into document_chunks")
+    parser.add_argument("paths", nargs="+", help="directories (searched recursively) or PDF files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="worker processes")
+    parser.add_argument("--checkpoint", default="ingest_checkpoint.jsonl", help="progress file used to resume")
+    parser.add_argument("--id-style", choices=("relative", "name"), default="relative",
+                        help="document_id is the path relative to the given directory, or just the file name (like the uploader)")
+    parser.add_argument("--worker-connections", type=int, default=2, help="database pool size in each worker process")
+    parser.add_argument("--rebuild-index", action="store_true", help="rebuild the ANN index when done")
+    args = parser.parse_args()
+
+    rag.ensure_schema()
+    #the workers are forked from this process, so they must not inherit its pooled connections
+    #(they would all talk over the same sockets); each worker opens its own pool instead
+    rag.get_db_pool()["pool"].closeall()
+    rag.get_db_pool.clear()
+    done  = load_checkpoint(args.checkpoint)
+    todo  = []
+    for pdf_path, root in find_pdfs(args.paths):
+        doc_hash = file_hash(pdf_path)
+        if (pdf_path, doc_hash) in done:
+            continue
+        if args.id_style == "name":
+            document_id = os.path.basename(pdf_path)
+        else:
+            document_id = os.path.relpath(pdf_path, root)
+        todo.append((pdf_path, document_id, doc_hash))
+    print(f"{len(todo)} PDFs to ingest ({len(done)} already in {args.checkpoint})")
+
+    totals   = dict.fromkeys(STAT_KEYS, 0)
+    failures = 0
+    start    = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                             initargs=(args.worker_connections,)) as pool, open(args.checkpoint, "a") as checkpoint:
+        pending = deque()
+        tasks   = iter(todo)
+
+        #keeps only a couple of tasks per worker queued, so results are checkpointed as they finish
+        def submit_next():
+            task = next(tasks, None)
+            if task is not None:
+                pending.append((task, pool.submit(ingest_one, *task)))
+
+        for _ in range(args.workers * 2):
+            submit_next()
+        while pending:
+            (pdf_path, document_id, doc_hash), future = pending.popleft()
+            try:
+                stored, stats, elapsed = future.result()
+            except Exception as e: #one bad PDF shouldn't stop the run; it isn't checkpointed, so it is retried next time
+                failures += 1
+                print(f"{pdf_path}: FAILED ({e})", file=sys.stderr)
+                submit_next()
+                continue
+            submit_next()
+            for key in STAT_KEYS:
+                totals[key] += stats.get(key, 0)
+            print_file_line(pdf_path, stored, stats, elapsed)
+            checkpoint.write(json.dumps({"path": pdf_path, "hash": doc_hash, "document_id": document_id, "stored": stored}) + "\n")
+            checkpoint.flush()
+    wall = time.perf_counter() - start
+
+    print(f"\nDone in {wall:.1f}s with {args.workers} workers ({failures} failed)")
+    print(f"  pages:  {totals['pages']} ({rate(totals['pages'], wall):.1f} pages/s, extract busy {totals['extract_seconds']:.1f}s)")
+    print(f"  chunks: {totals['chunks']} ({rate(totals['chunks'], wall):.1f} chunks/s, chunk busy {totals['chunk_seconds']:.1f}s, "
+          f"embed busy {totals['embed_seconds']:.1f}s)")
+    print(f"  rows:   {totals['rows']} ({rate(totals['rows'], wall):.1f} rows/s, insert busy {totals['insert_seconds']:.1f}s)")
+
+    if args.rebuild_index and totals["rows"]:
+        rag.rebuild_index()
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
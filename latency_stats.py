@@ -0,0 +1,11 @@
+#Small helpers shared by the benchmark and batch scripts (rag_benchmark.py, ask_latency_benchmark.py, nl_to_sql_batch.py)
+import math
+
+
+#nearest-rank percentile of a list of numbers
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
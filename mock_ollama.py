@@ -0,0 +1,192 @@
+#A small stand-in for the Ollama HTTP API, for benchmarks and latency comparisons
+#1. embeddings are deterministic: every word is hashed into a few dimensions (feature hashing),
+#   so texts that share words get similar vectors and retrieval behaves sensibly
+#2. generation returns a canned answer, streamed word by word like the real server
+#3. optional delays emulate a real model (per embedding request, before the first token, per token)
+#Only the endpoints the scripts in this folder use are implemented:
+#/api/embed, /api/embeddings, /api/generate, /api/chat, /api/tags, /api/ps, /api/show, /api/version
+#usage: python mock_ollama.py [--port 11435] [--dim 768] [--token-delay 0.01]
+#then point the clients at it with OLLAMA_HOST=http://127.0.0.1:11435
+import argparse
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_ANSWER = "Based on the context, the answer is in the passages provided above."
+CANNED_SQL    = "SELECT * FROM Customers LIMIT 10;"
+WORD_PATTERN  = re.compile(r"\w+")
+
+
+#deterministic embedding: each word adds +-1 to three hashed dimensions, then the vector is normalized
+def mock_embedding(text, dim):
+    vector = [0.0] * dim
+    for word in WORD_PATTERN.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=12).digest()
+        for i in range(3):
+            bucket = int.from_bytes(digest[i * 4:i * 4 + 4], "little")
+            vector[bucket % dim] += 1.0 if bucket & 1 << 31 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+def now():
+    return datetime.now(timezone.utc).isoformat()
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" #keep-alive, like the real server
+
+    #the settings live on the server object (see start_mock_server)
+    @property
+    def settings(self):
+        return self.server.settings
+
+    def log_message(self, format, *args):
+        pass #quiet; the benchmarks print their own output
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    #streams newline-delimited JSON with chunked transfer encoding
+    def send_stream(self, payloads):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for payload in payloads:
+            line = (json.dumps(payload) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self.send_json({"models": [self.model_info(name) for name in self.settings["models"]]})
+        elif self.path == "/api/ps":
+            self.send_json({"models": [self.model_info(name) for name in self.settings["models"][:1]]})
+        elif self.path == "/api/version":
+            self.send_json({"version": "0.0.0-mock"})
+        elif self.path == "/":
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_json({"error": f"unknown endpoint {self.path}"}, status=404)
+
+    def do_POST(self):
+        request = self.read_json()
+        model   = request.get("model", "mock")
+        if self.path == "/api/embed":
+            texts = request.get("input", "")
+            texts = [texts] if isinstance(texts, str) else texts
+            time.sleep(self.settings["embed_delay"])
+            self.send_json({"model": model, "embeddings": [mock_embedding(t, self.settings["dim"]) for t in texts]})
+        elif self.path == "/api/embeddings":
+            time.sleep(self.settings["embed_delay"])
+            self.send_json({"embedding": mock_embedding(request.get("prompt", ""), self.settings["dim"])})
+        elif self.path == "/api/generate":
+            self.generate(model, request, request.get("prompt", ""), chat=False)
+        elif self.path == "/api/chat":
+            messages = request.get("messages") or [{}]
+            self.generate(model, request, messages[-1].get("content", ""), chat=True)
+        elif self.path == "/api/show":
+            self.send_json({"modelfile": "", "parameters": "", "template": "{{ .Prompt }}",
+                            "details": self.model_info(model)["details"], "model_info": {}, "capabilities": ["completion"]})
+        else:
+            self.send_json({"error": f"unknown endpoint {self.path}"}, status=404)
+
+    #canned reply: JSON scores for re-rank prompts, SQL for NL-to-SQL prompts, a fixed sentence otherwise
+    def canned_reply(self, request, prompt):
+        if request.get("format") == "json":
+            passages = len(re.findall(r"^\[\d+\]", prompt, flags=re.MULTILINE))
+            return json.dumps({"scores": [max(0, 10 - i) for i in range(passages)]})
+        if "SQL" in prompt:
+            return CANNED_SQL
+        return CANNED_ANSWER
+
+    def generate(self, model, request, prompt, chat):
+        reply = self.canned_reply(request, prompt)
+        time.sleep(self.settings["first_token_delay"])
+
+        def message(text, done):
+            payload = {"model": model, "created_at": now(), "done": done}
+            if chat:
+                payload["message"] = {"role": "assistant", "content": text}
+            else:
+                payload["response"] = text
+            if done:
+                payload.update({"done_reason": "stop", "total_duration": 0, "eval_count": len(reply.split())})
+            return payload
+
+        if not request.get("stream", True): #Ollama streams unless told not to
+            time.sleep(self.settings["token_delay"] * len(reply.split()))
+            self.send_json(message(reply, True))
+            return
+
+        def tokens():
+            for i, word in enumerate(reply.split(" ")):
+                time.sleep(self.settings["token_delay"])
+                yield message(word if i == 0 else " " + word, False)
+            yield message("", True)
+        self.send_stream(tokens())
+
+    def model_info(self, name):
+        return {
+            "name": name, "model": name, "modified_at": now(), "size": 4_700_000_000,
+            "digest": hashlib.sha256(name.encode()).hexdigest(),
+            "details": {"format": "gguf", "family": name.split(":")[0], "parameter_size": "8B", "quantization_level": "Q4_0"},
+            "expires_at": now(), "size_vram": 4_700_000_000,
+        }
+
+#starts the mock server in a background thread and returns it (call server.shutdown() to stop)
+#port 0 picks a free port; the real one is server.server_address[1]
+def start_mock_server(host="127.0.0.1", port=0, dim=768, embed_delay=0.0, first_token_delay=0.0, token_delay=0.0, models=("llama3:latest",)):
+    server = ThreadingHTTPServer((host, port), MockOllamaHandler)
+    server.daemon_threads = True
+    server.settings = {
+        "dim": dim,
+        "embed_delay": embed_delay,
+        "first_token_delay": first_token_delay,
+        "token_delay": token_delay,
+        "models": list(models),
+    }
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a mock Ollama server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--dim", type=int, default=768, help="embedding size (match TABLE_DIM)")
+    parser.add_argument("--embed-delay", type=float, default=0.0, help="seconds per embedding request")
+    parser.add_argument("--first-token-delay", type=float, default=0.0, help="seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds per generated token")
+    args = parser.parse_args()
+    server = start_mock_server(args.host, args.port, args.dim, args.embed_delay, args.first_token_delay, args.token_delay)
+    print(f"Mock Ollama listening on http://{args.host}:{server.server_address[1]} (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#Batch mode for LLMtoSQL3: translates a whole file of questions and checks the SQL against the database
+#1. reads the questions (a text file with one per line, blank lines and # comments skipped,
+#   or a CSV with a "question" column and optionally an "id" column)
+#2. translates them with a bounded pool of threads, each calling nl_to_sql (one ollama.chat per question)
+#3. runs each query read-only with a timeout (same engine as the UI: pooled, EXPLAIN cost check)
+#   and counts the rows it returns, streaming them from a server-side cursor
+#4. writes a CSV report (question, SQL, tables in the prompt, row count, error, latency per step)
+#   and prints a summary, so runs with different models can be compared
+#usage: python nl_to_sql_batch.py questions.txt [--model llama3] [--workers 4] [--timeout 30] [--report report.csv] [--no-cache]
+import argparse
+import csv
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import psycopg2
+import LLMtoSQL3 as sql
+from latency_stats import percentile
+
+REPORT_COLUMNS = ("id", "question", "sql", "tables", "rows", "error", "translate_seconds", "execute_seconds")
+
+
+#reads the questions as (id, question) pairs
+def load_questions(path):
+    with open(path, newline="") as f:
+        if path.lower().endswith(".csv"):
+            return [(row.get("id") or str(i), row["question"]) for i, row in enumerate(csv.DictReader(f), 1)
+                    if row["question"].strip()]
+        lines = [line.strip() for line in f]
+    questions = [line for line in lines if line and not line.startswith("#")]
+    return [(str(i), q) for i, q in enumerate(questions, 1)]
+
+#runs in a worker thread: translates one question and runs its SQL, returns a report row
+#db_slots keeps the number of queries running at once within the connection pool's size
+def run_question(question_id, question, model, timeout_ms, max_rows, use_cache, db_slots):
+    result = {"id": question_id, "question": question, "sql": "", "tables": "", "rows": "", "error": "",
+              "translate_seconds": 0.0, "execute_seconds": 0.0}
+    tables = []
+    start  = time.perf_counter()
+    try:
+        sql_query = sql.nl_to_sql(question, model=model, tables=tables, use_cache=use_cache)
+    except Exception as e: #catalog load, SQL cache or pool failures fail this question, not the run
+        result["error"] = f"translation failed: {type(e).__name__}: {str(e).strip()}"
+        result["translate_seconds"] = round(time.perf_counter() - start, 3)
+        return result
+    result["translate_seconds"] = round(time.perf_counter() - start, 3)
+    result["tables"] = " ".join(tables)
+    if not sql_query:
+        result["error"] = "model returned no SQL"
+        return result
+    result["sql"] = sql_query
+
+    query = sql.clean_sql(sql_query)
+    if max_rows:
+        query = sql.limit_sql(query, max_rows)
+    start = time.perf_counter()
+    try:
+        with db_slots:
+            result["rows"] = sum(len(rows) for _, rows in sql.iter_batches(query, timeout_ms=timeout_ms))
+    except sql.QueryRejected as e:
+        result["error"] = f"rejected: {e}"
+    except psycopg2.errors.QueryCanceled:
+        result["error"] = f"timeout after {timeout_ms} ms"
+    except psycopg2.Error as e:
+        result["error"] = f"database error: {str(e).strip()}"
+    except Exception as e: #e.g. PoolError; recorded like the rest so the report stays complete
+        result["error"] = f"{type(e).__name__}: {str(e).strip()}"
+    result["execute_seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Translate a file of questions to SQL and check the SQL against the database")
+    parser.add_argument("questions", help="text file (one question per line) or CSV with a question column")
+    parser.add_argument("--model", default=sql.LLM_MODEL)
+    parser.add_argument("--workers", type=int, default=4, help="questions translated at the same time")
+    parser.add_argument("--timeout", type=float, default=sql.STATEMENT_TIMEOUT_MS / 1000, help="seconds each query may run")
+    parser.add_argument("--max-rows", type=int, default=0, help="stop counting rows after this many (0 = count all)")
+    parser.add_argument("--report", default="nl_to_sql_report.csv")
+    parser.add_argument("--no-cache", action="store_true", help="always ask the model instead of reusing cached SQL")
+    args = parser.parse_args()
+
+    questions  = load_questions(args.questions)
+    timeout_ms = int(args.timeout * 1000)
+    db_slots   = threading.BoundedSemaphore(sql.DB_POOL_MAX)
+    print(f"{len(questions)} questions, model {args.model}, {args.workers} workers")
+
+    results = []
+    start   = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool, open(args.report, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+        writer.writeheader()
+        pending = deque()
+        tasks   = iter(questions)
+
+        #only a couple of questions per worker are queued, and the report is written in question order
+        def submit_next():
+            task = next(tasks, None)
+            if task is not None:
+                pending.append(pool.submit(run_question, *task, args.model, timeout_ms, args.max_rows,
+                                           not args.no_cache, db_slots))
+
+        for _ in range(args.workers * 2):
+            submit_next()
+        while pending:
+            result = pending.popleft().result()
+            submit_next()
+            results.append(result)
+            writer.writerow(result)
+            f.flush()
+            status = result["error"] or f"{result['rows']} rows"
+            print(f"[{result['id']}] {result['translate_seconds']:.2f}s + {result['execute_seconds']:.2f}s  {status}")
+    wall = time.perf_counter() - start
+
+    failed    = [r for r in results if r["error"]]
+    translate = [r["translate_seconds"] for r in results]
+    execute   = [r["execute_seconds"] for r in results if r["sql"]]
+    print(f"\nDone in {wall:.1f}s: {len(results) - len(failed)} ok, {len(failed)} failed, report in {args.report}")
+    print(f"  translate: p50 {percentile(translate, 50):.2f}s, p95 {percentile(translate, 95):.2f}s")
+    print(f"  execute:   p50 {percentile(execute, 50):.2f}s, p95 {percentile(execute, 95):.2f}s")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#End-to-end benchmark for Basic_RAG_Pipeline3
+#1. starts the mock Ollama server (mock_ollama.py: deterministic embeddings, canned answers)
+#2. writes a fixed synthetic corpus of PDFs, each page stating facts like
+#   "The part number for the valve assembly is PN-48213." so every question has one right page
+#3. ingests the corpus into a local Postgres + pgvector database (DB_* settings, BENCH_DB_NAME database)
+#4. asks one question per fact and checks whether the right page was retrieved
+#5. reports latency percentiles per stage (extract, chunk, embed, insert, retrieve, generate),
+#   throughput and retrieval recall; --save / --baseline catch regressions between runs
+#The benchmark database's document_chunks / document_manifest tables are dropped at the start
+#usage: python rag_benchmark.py [--documents 20] [--pages 5] [--top-k 5] [--save bench.json] [--baseline bench.json]
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from mock_ollama import start_mock_server
+from latency_stats import percentile
+
+STAGES = ("extract", "chunk", "embed", "insert", "retrieve", "generate")
+WORDS  = ("valve", "pump", "gasket", "rotor", "sensor", "relay", "bracket", "manifold", "filter", "bearing",
+          "housing", "coupling", "actuator", "nozzle", "spring", "clamp", "flange", "piston", "seal", "switch")
+FILLER = ("Routine inspection is recommended every quarter.", "Refer to the safety sheet before servicing.",
+          "Operating temperature must stay within the rated range.", "Replacement intervals depend on duty cycle.",
+          "Only trained personnel should perform adjustments.", "Torque values are listed in the appendix.")
+
+
+#writes the synthetic PDFs and returns the questions as (question, document_id, page)
+#the same seed always gives the same corpus, so runs are comparable
+def build_corpus(directory, documents, pages, facts_per_page, seed=42):
+    import fitz
+    rng = random.Random(seed)
+    questions = []
+    for d in range(documents):
+        document_id = f"manual_{d:03d}.pdf"
+        pdf = fitz.open()
+        for p in range(1, pages + 1):
+            lines = []
+            for _ in range(facts_per_page):
+                component = f"{rng.choice(WORDS)} {rng.choice(WORDS)} unit {rng.randint(100, 999)}"
+                code      = f"PN-{rng.randint(10000, 99999)}"
+                lines.append(f"The part number for the {component} is {code}. " + " ".join(rng.sample(FILLER, 2)))
+                questions.append((f"What is the part number for the {component}?", document_id, p))
+            page = pdf.new_page()
+            page.insert_textbox(fitz.Rect(50, 50, 550, 800), "\n\n".join(lines), fontsize=9)
+        pdf.save(os.path.join(directory, document_id))
+        pdf.close()
+    return questions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the RAG pipeline against a mock Ollama server")
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--facts-per-page", type=int, default=4)
+    parser.add_argument("--questions", type=int, default=100, help="how many of the facts to ask about")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--dim", type=int, default=int(os.getenv("TABLE_DIM") or 768))
+    parser.add_argument("--embed-delay", type=float, default=0.0, help="mock seconds per embedding request")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="mock seconds per generated token")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare p95 latencies and recall against this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 slowdown vs the baseline (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    #the pipeline reads its settings at import time, so everything is set up before importing it
+    server = start_mock_server(dim=args.dim, embed_delay=args.embed_delay, token_delay=args.token_delay)
+    workdir = tempfile.mkdtemp(prefix="rag_bench_")
+    os.environ["OLLAMA_HOST"]      = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["DB_NAME"]          = os.getenv("BENCH_DB_NAME", "rag_bench")
+    os.environ["TABLE_DIM"]        = str(args.dim)
+    os.environ["EMBED_CACHE_PATH"] = os.path.join(workdir, "embedding_cache.sqlite3") #start cold every run
+    os.environ.setdefault("EMBED_MODEL", "mock-embed")
+    os.environ.setdefault("LLM_MODEL", "mock-llm")
+    import Basic_RAG_Pipeline3 as rag
+
+    conn = rag.get_db_connection()
+    with conn.cursor() as cur:
+        cur.execute("DROP TABLE IF EXISTS document_chunks, document_manifest;")
+    rag.release_db_connection(conn)
+    rag.ensure_schema()
+
+    questions = build_corpus(workdir, args.documents, args.pages, args.facts_per_page)
+    questions = random.Random(7).sample(questions, min(args.questions, len(questions)))
+    latencies = {stage: [] for stage in STAGES}
+    totals    = {"pages": 0, "chunks": 0, "rows": 0}
+
+    #ingestion: one store_pdf per document, stage times come from its stats
+    ingest_start = time.perf_counter()
+    for name in sorted(os.listdir(workdir)):
+        if not name.endswith(".pdf"):
+            continue
+        stats = {}
+        rag.store_pdf(name, os.path.join(workdir, name), stats=stats, pdf_workers=1)
+        for stage in ("extract", "chunk", "embed", "insert"):
+            latencies[stage].append(stats[f"{stage}_seconds"])
+        for key in totals:
+            totals[key] += stats.get(key, 0)
+    ingest_seconds = time.perf_counter() - ingest_start
+
+    #question answering: retrieval recall is checked on the chunks that went into the prompt
+    hits = 0
+    ask_start = time.perf_counter()
+    for question, document_id, page in questions:
+        timings, sources = {}, []
+        for _ in rag.stream_answer(question, top_n=args.top_k, timings=timings, sources=sources):
+            pass #the answer itself is canned, only the timings matter
+        latencies["retrieve"].append(timings["retrieve_seconds"])
+        latencies["generate"].append(timings.get("generate_seconds", 0.0))
+        if any(row[4] == document_id and row[1].get("page") == page for row in sources):
+            hits += 1
+    ask_seconds = time.perf_counter() - ask_start
+    server.shutdown()
+
+    results = {
+        "settings": {k: getattr(args, k) for k in ("documents", "pages", "facts_per_page", "questions", "top_k", "dim")},
+        "latency_ms": {
+            stage: {p: round(percentile(values, int(p[1:])) * 1000, 2) for p in ("p50", "p95", "p99")}
+            for stage, values in latencies.items()
+        },
+        "throughput": {
+            "pages_per_s": round(totals["pages"] / ingest_seconds, 1),
+            "chunks_per_s": round(totals["chunks"] / ingest_seconds, 1),
+            "rows_per_s": round(totals["rows"] / ingest_seconds, 1),
+            "questions_per_s": round(len(questions) / ask_seconds, 2),
+        },
+        "recall": round(hits / len(questions), 3) if questions else 0.0,
+    }
+
+    print(f"Corpus: {args.documents} documents x {args.pages} pages, {totals['chunks']} chunks, {len(questions)} questions")
+    print(f"{'stage':<10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage in STAGES:
+        row = results["latency_ms"][stage]
+        print(f"{stage:<10} {row['p50']:>9} {row['p95']:>9} {row['p99']:>9}")
+    print("throughput: " + ", ".join(f"{k} {v}" for k, v in results["throughput"].items()))
+    print(f"recall@{args.top_k}: {results['recall']}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = []
+        for stage in STAGES:
+            old, new = baseline["latency_ms"][stage]["p95"], results["latency_ms"][stage]["p95"]
+            if old > 0 and new > old * (1 + args.tolerance):
+                regressions.append(f"{stage} p95 {old} -> {new} ms")
+        if results["recall"] < baseline["recall"] - 0.01:
+            regressions.append(f"recall {baseline['recall']} -> {results['recall']}")
+        if regressions:
+            print("REGRESSIONS against " + args.baseline + ":\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
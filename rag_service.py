@@ -0,0 +1,266 @@
+#Async HTTP service for Basic_RAG_Pipeline3, so the Streamlit page can be a thin client
+#and several users (or several service workers behind a load balancer) don't block each other
+#1. POST /ingest?document_id=name.pdf  (body: the PDF) -> queues the PDF, returns a job ID right away
+#   background workers store it with the same pipeline as the UI (store_pdf: extract -> chunk -> embed -> insert)
+#2. GET  /jobs/{job_id}  -> queued / running / done / failed, with the stage stats when done
+#3. POST /ask  {"question": ..., "top_n": 5, "mode": "hybrid", "filters": {...}, "rerank": true, "stream": true}
+#   -> the answer, streamed as newline-delimited JSON: {"token": ...} lines, then {"done": true, "timings", "sources"}
+#4. GET  /documents, GET /stats
+#Questions use asyncpg and ollama.AsyncClient, so waiting on Postgres or the model never holds up other requests
+#Ingestion jobs are kept in the ingest_jobs table, so any worker can answer GET /jobs
+#usage: uvicorn rag_service:app --host 0.0.0.0 --port 8000 --workers 4
+#then run the UI with RAG_SERVICE_URL=http://localhost:8000 streamlit run Basic_RAG_Pipeline3.py
+import asyncio
+import decimal
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+from contextlib import asynccontextmanager
+import asyncpg
+import ollama
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pgvector.asyncpg import register_vector
+from pydantic import BaseModel
+import Basic_RAG_Pipeline3 as rag
+
+#how many PDFs each service process stores at the same time, and how many can wait in its queue
+INGEST_WORKERS    = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "100"))
+#where uploaded PDFs wait until a worker has stored them
+UPLOAD_DIR        = os.getenv("UPLOAD_DIR", tempfile.gettempdir())
+
+#the pipeline's queries use psycopg2's %(name)s placeholders, asyncpg wants $1, $2, ...
+PARAM_PATTERN = re.compile(r"%\((\w+)\)s")
+
+
+class AskRequest(BaseModel):
+    question: str
+    top_n: int = 5
+    mode: str = rag.RETRIEVAL_MODE
+    filters: dict = None
+    rerank: bool = bool(rag.RERANK_MODEL)
+    stream: bool = True
+
+#rewrites a query with named placeholders for asyncpg: returns (sql, positional arguments)
+#a name that is used several times (like q_emb) becomes one $n
+def to_asyncpg(sql, params):
+    names = []
+    def placeholder(match):
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+    return PARAM_PATTERN.sub(placeholder, sql), [params[name] for name in names]
+
+#per-connection setup: the vector type, and jsonb metadata coming back as dicts
+#(jsonb parameters are already JSON text, see rag.filter_sql, so they are passed through as is)
+async def init_connection(conn):
+    await register_vector(conn)
+    await conn.set_type_codec("jsonb", encoder=str, decoder=json.loads, schema="pg_catalog")
+
+#rows as JSON-friendly lists, in the same order as the pipeline's rows
+def jsonable_row(row):
+    return [str(v) if isinstance(v, uuid.UUID) else float(v) if isinstance(v, decimal.Decimal) else v for v in row]
+
+async def ensure_jobs_table(pool):
+    await pool.execute("""
+      CREATE TABLE IF NOT EXISTS ingest_jobs (
+        job_id      UUID PRIMARY KEY,
+        document_id TEXT NOT NULL,
+        status      TEXT NOT NULL,
+        stored      INT,
+        stats       JSONB,
+        error       TEXT,
+        created_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+        finished_at TIMESTAMPTZ
+      );
+    """)
+
+async def set_job(pool, job_id, status, stored=None, stats=None, error=None):
+    finished = status in ("done", "failed")
+    await pool.execute("""
+      UPDATE ingest_jobs
+      SET status = $2, stored = $3, stats = $4::jsonb, error = $5,
+          finished_at = CASE WHEN $6 THEN now() END
+      WHERE job_id = $1;
+    """, job_id, status, stored, json.dumps(stats) if stats is not None else None, error, finished)
+
+#takes PDFs off the queue and stores them one at a time
+#store_pdf is the same synchronous pipeline the UI uses (its own embedding threads, PDF processes
+#and psycopg2 pool), so it runs in a thread and the event loop keeps serving questions meanwhile
+async def ingest_worker(app):
+    pool, queue = app.state.db, app.state.queue
+    while True:
+        job_id, document_id, pdf_path, doc_hash = await queue.get()
+        try:
+            await set_job(pool, job_id, "running")
+            stats  = {}
+            stored = await asyncio.to_thread(rag.store_pdf, document_id, pdf_path, doc_hash=doc_hash, stats=stats)
+            await set_job(pool, job_id, "done", stored, stats)
+        except Exception as e: #a bad PDF fails its own job, not the worker
+            await set_job(pool, job_id, "failed", error=str(e))
+        finally:
+            os.remove(pdf_path)
+            queue.task_done()
+
+#startup: schema, the asyncpg pool, the shared ollama client and the ingestion workers
+@asynccontextmanager
+async def lifespan(app):
+    await asyncio.to_thread(rag.ensure_schema)
+    await asyncio.to_thread(rag.iterative_scan_supported) #cached, so retrieve never queries it on the event loop
+    app.state.db     = await asyncpg.create_pool(
+        database=rag.DB_NAME, user=rag.DB_USER, password=rag.DB_PASS, host=rag.DB_HOST, port=rag.DB_PORT,
+        min_size=rag.DB_POOL_MIN, max_size=rag.DB_POOL_MAX, init=init_connection,
+    )
+    app.state.ollama = ollama.AsyncClient() #reads OLLAMA_HOST like the module-level functions
+    app.state.queue  = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+    await ensure_jobs_table(app.state.db)
+    workers = [asyncio.create_task(ingest_worker(app)) for _ in range(INGEST_WORKERS)]
+    try:
+        yield
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await app.state.db.close()
+
+app = FastAPI(title="PDF Q&A with Ollama + PostgreSQL", lifespan=lifespan)
+
+#the question's embedding, from the shared embedding cache when possible
+#the cache reads and writes SQLite under a lock the ingestion threads also take, so it is used from a thread
+async def embed_question(app, question):
+    cache  = rag.get_embedding_cache()
+    cached = (await asyncio.to_thread(cache.get_many, rag.EMBED_MODEL, [question]))[0]
+    if cached is not None:
+        return cached
+    resp = await app.state.ollama.embed(model=rag.EMBED_MODEL, input=question)
+    await asyncio.to_thread(cache.put_many, rag.EMBED_MODEL, [question], resp["embeddings"])
+    return resp["embeddings"][0]
+
+#async version of rag.retrieve: same SQL and index settings, run through asyncpg
+#SET LOCAL (set_config(..., true)) keeps the settings inside this transaction, so pooled connections stay clean
+async def retrieve(app, question, q_emb, top_n, mode, filters):
+    filtered = bool(rag.filter_sql(filters)[0])
+    if mode == "hybrid":
+        candidates  = max(rag.HYBRID_CANDIDATES, top_n)
+        sql, params = rag.search_hybrid_query(q_emb, question, top_n, candidates, filters)
+        settings    = rag.search_settings(rag.first_pass_size(candidates), filtered=filtered)
+    else:
+        sql, params = rag.search_chunks_query(q_emb, top_n, filters)
+        settings    = rag.search_settings(rag.first_pass_size(top_n), filtered=filtered)
+    sql, args = to_asyncpg(sql, params)
+    async with app.state.db.acquire() as conn:
+        async with conn.transaction():
+            for name, value in settings:
+                await conn.execute("SELECT set_config($1, $2, true);", name, str(value))
+            rows = await conn.fetch(sql, *args)
+    return [tuple(r) for r in rows]
+
+#async version of rag.stream_answer: yields the answer piece by piece, fills timings and sources
+async def stream_answer(app, ask, timings, sources):
+    start        = time.perf_counter()
+    rerank_model = rag.RERANK_MODEL if ask.rerank else ""
+    q_emb        = await embed_question(app, ask.question)
+    fetch        = max(rag.RERANK_CANDIDATES, ask.top_n) if rerank_model else ask.top_n
+    results      = await retrieve(app, ask.question, q_emb, fetch, ask.mode, ask.filters)
+    timings["retrieve_seconds"] = time.perf_counter() - start
+    if not results:
+        yield " No context found for that question."
+        return
+
+    cache     = rag.get_answer_cache()
+    chunk_ids = frozenset(str(r[3]) for r in results)
+    settings  = (rag.LLM_MODEL, ask.mode, ask.top_n, json.dumps(ask.filters, sort_keys=True), rerank_model)
+    cached    = cache.lookup(q_emb, chunk_ids, settings)
+    if cached is not None:
+        sources.extend(results[:ask.top_n])
+        timings["first_token_seconds"] = timings["total_seconds"] = time.perf_counter() - start
+        timings["generate_seconds"] = 0.0
+        timings["cache_hit"] = 1
+        yield cached
+        return
+
+    #re-ranking is one blocking ollama call, so it goes to a thread with the rest of the prompt building
+    prompt, results = await asyncio.to_thread(rag.prepare_prompt, ask.question, results, ask.top_n, rerank_model, timings)
+    sources.extend(results)
+    generate_start = time.perf_counter()
+    parts = []
+    async for part in await app.state.ollama.generate(model=rag.LLM_MODEL, prompt=prompt, stream=True):
+        token = part["response"]
+        if token and "first_token_seconds" not in timings:
+            timings["first_token_seconds"] = time.perf_counter() - start
+        parts.append(token)
+        yield token
+    cache.store(q_emb, chunk_ids, {r[4] for r in results}, settings, "".join(parts))
+    timings["generate_seconds"] = time.perf_counter() - generate_start
+    timings["total_seconds"]    = time.perf_counter() - start
+
+@app.post("/ask")
+async def ask_question(ask: AskRequest, request: Request):
+    if ask.mode not in ("vector", "hybrid"):
+        raise HTTPException(400, f"mode must be vector or hybrid, got {ask.mode!r}")
+    timings, sources = {}, []
+    answer = stream_answer(request.app, ask, timings, sources)
+    if not ask.stream:
+        text = "".join([token async for token in answer]).strip()
+        return {"answer": text, "timings": timings, "sources": [jsonable_row(r) for r in sources]}
+
+    async def lines():
+        async for token in answer:
+            yield json.dumps({"token": token}) + "\n"
+        yield json.dumps({"done": True, "timings": timings, "sources": [jsonable_row(r) for r in sources]}) + "\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+#the PDF is the raw request body; it is written to UPLOAD_DIR (and hashed) as it arrives
+#returns 202 with the job ID, or 503 when the queue is full
+@app.post("/ingest", status_code=202)
+async def ingest(document_id: str, request: Request):
+    queue = request.app.state.queue
+    if queue.full():
+        raise HTTPException(503, "ingestion queue is full, try again later")
+    digest = hashlib.sha256()
+    #file writes go to a thread so a slow disk doesn't hold up the questions being answered meanwhile
+    f = await asyncio.to_thread(tempfile.NamedTemporaryFile, dir=UPLOAD_DIR, prefix="upload_", suffix=".pdf", delete=False)
+    try:
+        async for block in request.stream():
+            digest.update(block)
+            await asyncio.to_thread(f.write, block)
+    except BaseException: #the upload broke off, don't leave half a PDF behind
+        await asyncio.to_thread(f.close)
+        os.remove(f.name)
+        raise
+    await asyncio.to_thread(f.close)
+    job_id = uuid.uuid4()
+    await request.app.state.db.execute(
+        "INSERT INTO ingest_jobs (job_id, document_id, status) VALUES ($1, $2, 'queued');", job_id, document_id)
+    await queue.put((job_id, document_id, f.name, digest.hexdigest()))
+    return {"job_id": str(job_id), "document_id": document_id, "status": "queued"}
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: uuid.UUID, request: Request):
+    row = await request.app.state.db.fetchrow("SELECT * FROM ingest_jobs WHERE job_id = $1;", job_id)
+    if row is None:
+        raise HTTPException(404, f"no job {job_id}")
+    return dict(row)
+
+@app.get("/documents")
+async def documents(request: Request):
+    rows = await request.app.state.db.fetch(
+        "SELECT document_id, chunk_count, updated_at FROM document_manifest ORDER BY document_id;")
+    return {"documents": [dict(r) for r in rows]}
+
+#cache and pool numbers for this service process (the UI shows them in its sidebar)
+@app.get("/stats")
+async def stats(request: Request):
+    db = request.app.state.db
+    return {
+        "db_pool": {"max_size": db.get_max_size(), "size": db.get_size(), "idle": db.get_idle_size()},
+        "ingest_queue": request.app.state.queue.qsize(),
+        "embedding_cache": await asyncio.to_thread(rag.get_embedding_cache().summary),
+        "answer_cache": rag.get_answer_cache().summary(),
+    }